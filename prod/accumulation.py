@@ -0,0 +1,73 @@
+from vispy import gloo
+import numpy as np
+from blit import BlitProgram
+from resolution import RenderTarget
+from utils import halton
+
+
+class ProgressiveAccumulator(object):
+    """
+    Sums jittered passes of a `FractalProgram` into a float buffer while its
+    uniforms stay the same, and shows their average. Any uniform change (or a
+    different program or size) restarts the accumulation. Once `max_passes`
+    passes have been summed the fractal isn't drawn again until something
+    changes, and each frame only costs the resolve.
+    """
+
+    def __init__(self, max_passes=64):
+        self.max_passes = max_passes
+        self.target = RenderTarget(internalformat='rgba32f')
+        self.resolve_program = BlitProgram(self.target.texture)
+        self.passes = 0
+        self._fractal = None
+
+    @property
+    def converged(self):
+        return self.passes >= self.max_passes
+
+    def reset(self):
+        self.passes = 0
+
+    def accumulate(self, fractal, size, render=None):
+        """
+        Add one more jittered pass of `fractal` at `size` (width, height) if
+        it isn't converged. `render` replaces `fractal.draw` for pipelines
+        that draw the fractal in more than one pass.
+        """
+        if self.target.resize(size):
+            self.resolve_program.set_source(self.target.texture)
+            self.reset()
+        if fractal.changed or fractal is not self._fractal:
+            fractal.changed = False
+            self._fractal = fractal
+            self.reset()
+
+        if self.converged:
+            return
+
+        # The first pass keeps the unjittered sample pattern, so a single pass matches a normal draw
+        fractal['jitter'] = (halton(self.passes, 2) - 0.5, halton(self.passes, 3) - 0.5) if self.passes else (0, 0)
+        fractal['sampleRotation'] = 2 * np.pi * halton(self.passes, 5)
+
+        with self.target.framebuffer:
+            gloo.set_viewport(0, 0, *size)
+            if self.passes == 0:
+                gloo.clear(color=(0, 0, 0, 0))
+            gloo.set_state(blend_func=('one', 'one'))
+            (render or fractal.draw)()
+            gloo.set_state(blend_func=('src_alpha', 'one_minus_src_alpha'))
+
+        fractal['jitter'] = (0, 0)
+        fractal['sampleRotation'] = 0
+
+        self.passes += 1
+
+    def resolve(self):
+        """ Draw the average of the accumulated passes into the current framebuffer. """
+        self.resolve_program['gain'] = 1.0 / max(self.passes, 1)
+        self.resolve_program.draw()
+
+    def draw(self, fractal, size, render=None):
+        self.accumulate(fractal, size, render)
+        gloo.set_viewport(0, 0, *size)
+        self.resolve()
@@ -0,0 +1,35 @@
+from vispy import gloo
+from resolution import RenderTarget
+
+
+class AdaptiveAntialiaser(object):
+    """
+    Draws a `FractalProgram` compiled with ADAPTIVE_ANTIALIAS in two passes:
+    one ray per pixel into a float texture holding colour and hit depth, then
+    a pass that only supersamples pixels whose depth or colour differs from a
+    neighbour's. Flat interiors and the background cost a single ray.
+    """
+
+    def __init__(self, depth_threshold=0.02, color_threshold=0.1):
+        self.depth_threshold = depth_threshold
+        self.color_threshold = color_threshold
+        self.target = RenderTarget(internalformat='rgba32f', interpolation='nearest')
+
+    def draw(self, fractal, size):
+        """ Draw `fractal` at `size` (width, height) into the current framebuffer. """
+        self.target.resize(size)
+        fractal['firstPass'] = self.target.texture
+        fractal['edgeDepthThreshold'] = self.depth_threshold
+        fractal['edgeColorThreshold'] = self.color_threshold
+
+        # Blending would scale the stored colour by the depth kept in alpha
+        fractal['edgePass'] = False
+        with self.target.framebuffer:
+            gloo.set_viewport(0, 0, *size)
+            gloo.set_state(blend=False)
+            fractal.draw()
+            gloo.set_state(blend=True)
+
+        fractal['edgePass'] = True
+        gloo.set_viewport(0, 0, *size)
+        fractal.draw()
@@ -0,0 +1,157 @@
+from vispy import gloo
+import numpy as np
+import os
+import yaml
+from bounds import bounding_radius
+from definitions import parameter_values
+from fractal import FractalProgram, choose_variant
+from input import FakeInput
+from quality import quality_defines
+
+# The parameters each atlas cell reads from its row of the parameter texture, in the order LoadCellParams unpacks them,
+# followed by the cell's bounding radius
+ATLAS_PARAMS = ('iterationScale', 'iterationOffsetX', 'iterationOffsetY', 'iterationOffsetZ', 'iterations', 'trapWidth', 'angleA', 'angleB', 'angleC')
+
+
+def parameter_grid(x_param, y_param, columns=16, rows=16, inputs=None, x_range=(0.0, 1.0), y_range=(0.0, 1.0)):
+    """
+    Normalized inputs for each cell of a `columns` x `rows` sweep, row by
+    row from the top left. `x_param` sweeps across `x_range` along each row
+    and `y_param` across `y_range` down the columns, with everything else
+    from `inputs`, FakeInput's starting inputs by default.
+    """
+    base = dict(inputs if inputs is not None else FakeInput().smoothed_inputs)
+    cells = []
+    for y in np.linspace(y_range[0], y_range[1], rows):
+        for x in np.linspace(x_range[0], x_range[1], columns):
+            cell = dict(base)
+            cell[x_param] = float(x)
+            cell[y_param] = float(y)
+            cells.append(cell)
+    return cells
+
+
+class AtlasProgram(FractalProgram):
+    """
+    A fractal variant that draws a whole grid of cells in one draw, each cell
+    with its own parameters. They're looked up per pixel from a float
+    texture with a row of ATLAS_PARAMS per cell, instead of being uniforms.
+    """
+
+    def __init__(self, definition, columns, rows, cell_size, variant=None, quality='high'):
+        defines = quality_defines(quality, {'ATLAS': 1})
+        super(AtlasProgram, self).__init__(definition, variant=variant or choose_variant(definition), defines=defines)
+        self.columns = columns
+        self.rows = rows
+        self.cell_size = cell_size
+        self['atlasCells'] = (columns, rows)
+        self['atlasCellSize'] = cell_size
+        self['resolution'] = cell_size
+        self.params = gloo.Texture2D(shape=(columns * rows, 3, 4), internalformat='rgba32f', interpolation='nearest')
+        self['atlasParams'] = self.params
+
+    def use_definition(self, definition):
+        # The parameters aren't uniforms here, see set_cells
+        self.definition = definition
+
+    def set_cells(self, cells):
+        """ Upload each cell's normalized inputs, mapped onto the definition's ranges, in one texture upload. """
+        if len(cells) != self.columns * self.rows:
+            raise ValueError("Expected %d cells for a %dx%d atlas, got %d" % (self.columns * self.rows, self.columns, self.rows, len(cells)))
+        data = np.zeros((len(cells), 12), dtype=np.float32)
+        for index, inputs in enumerate(cells):
+            values = parameter_values(self.definition, inputs)
+            data[index, :len(ATLAS_PARAMS)] = [values[param] for param in ATLAS_PARAMS]
+            data[index, len(ATLAS_PARAMS)] = bounding_radius(self.variant[0], self.variant[1], values, self.distance_min) or 0.0
+        self.params.set_data(data.reshape(len(cells), 3, 4))
+
+    @property
+    def size(self):
+        return (self.columns * self.cell_size[0], self.rows * self.cell_size[1])
+
+
+def render_atlas(program, cells, time=0.0):
+    """ Draw every cell of `program` into an offscreen framebuffer in a single draw, and read back the contact sheet. """
+    width, height = program.size
+    framebuffer = gloo.FrameBuffer(color=gloo.RenderBuffer((height, width)))
+    program.set_cells(cells)
+    program['time'] = time
+    with framebuffer:
+        gloo.set_viewport(0, 0, width, height)
+        gloo.clear()
+        program.draw()
+        image = framebuffer.read()
+    framebuffer.delete()
+    return image
+
+
+def write_atlas(directory, image, cells, definition, time, columns):
+    """
+    Write the contact sheet, a cover style .yml per cell that FileStoredInput
+    (and still_render.py -l) can load, and an index of all the cells.
+    """
+    from vispy.io import write_png
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    write_png(os.path.join(directory, 'atlas.png'), image)
+
+    index = []
+    for number, inputs in enumerate(cells):
+        row, column = divmod(number, columns)
+        name = 'cell-%02d-%02d.yml' % (row, column)
+        data = dict(inputs)
+        data['time'] = time
+        data['definition'] = definition['name']
+        with open(os.path.join(directory, name), 'w') as f:
+            yaml.dump(data, stream=f)
+        index.append({'row': row, 'column': column, 'file': name, 'inputs': dict(inputs)})
+
+    with open(os.path.join(directory, 'index.yml'), 'w') as f:
+        yaml.dump({'definition': definition['name'], 'time': time, 'columns': columns, 'rows': len(cells) // columns, 'cells': index}, stream=f)
+    print "Wrote a %d cell atlas of %s to %s" % (len(cells), definition['name'], directory)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    from vispy import app, set_log_level
+    from definitions import Definitions
+    from gl_mode import use_gl_mode
+    from input import INPUT_KEYS, FileStoredInput
+    from quality import QUALITY_PRESETS
+    import time as timer
+    parser = OptionParser(usage="%prog [options] DIRECTORY")
+    parser.add_option("-d", "--definition", type="string")
+    parser.add_option("-x", type="choice", choices=INPUT_KEYS, default='iterationScale')
+    parser.add_option("-y", type="choice", choices=INPUT_KEYS, default='trapWidth')
+    parser.add_option("-c", "--columns", type="int", default=16)
+    parser.add_option("-r", "--rows", type="int", default=16)
+    parser.add_option("-s", "--cell-size", type="int", default=128)
+    parser.add_option("-l", "--path", type="string")
+    parser.add_option("-t", "--time", type="float", default=0.0)
+    parser.add_option("-q", "--quality", type="choice", choices=QUALITY_PRESETS.keys(), default='low')
+    parser.add_option("--backend", type="string", default="osmesa")
+
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected a directory to write the atlas to")
+    set_log_level('WARNING')
+    use_gl_mode('production')
+
+    # Cells not swept keep the inputs of a stored cover if given
+    inputs = None
+    definition_name = options.definition or sorted(Definitions.keys())[0]
+    if options.path:
+        stored = FileStoredInput(options.path)
+        inputs = stored.smoothed_inputs
+        definition_name = options.definition or stored.stored_definition_name
+    definition = Definitions[definition_name]
+
+    canvas = app.Canvas(app=options.backend, size=(1, 1), show=False)
+    canvas.set_current()
+    program = AtlasProgram(definition, options.columns, options.rows, (options.cell_size, options.cell_size), quality=options.quality)
+    cells = parameter_grid(options.x, options.y, options.columns, options.rows, inputs=inputs)
+
+    start = timer.time()
+    image = render_atlas(program, cells, options.time)
+    print "Rendered %d cells in one %dx%d draw in %.1fs" % (len(cells), program.size[0], program.size[1], timer.time() - start)
+    write_atlas(args[0], image, cells, definition, options.time, options.columns)
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from vispy import gloo
+import json
+import numpy as np
+import resource
+import time
+from fractal import COLOR_TRAP_FUNCTIONS
+from input import INPUT_KEYS
+from resolution import RenderTarget
+
+# Pinned input vectors each definition is rendered with
+BENCHMARK_INPUTS = OrderedDict([
+    ('low', dict((key, 0.1) for key in INPUT_KEYS)),
+    ('middle', dict((key, 0.5) for key in INPUT_KEYS)),
+    ('high', dict((key, 0.9) for key in INPUT_KEYS)),
+])
+BENCHMARK_TIMES = (0.0, 30.0)
+BENCHMARK_RESOLUTIONS = ((320, 240), (640, 480))
+
+# A scene is a regression when its steady frame time is this fraction slower than the baseline's
+REGRESSION_THRESHOLD = 0.1
+
+
+def scene_key(scene):
+    return '%s/%s/t%g/%dx%d' % (scene['definition'], scene['inputs'], scene['time'], scene['width'], scene['height'])
+
+
+def _peak_memory():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class RenderBenchmark(object):
+    """
+    Times every definition with each of `inputs` and `times` at each of
+    `resolutions`, drawing offscreen with the first trap function of each
+    definition so runs are comparable. For each scene the first draw is
+    timed on its own as the warm-up, then `frames` more are timed one by one
+    for the steady state. Program compile times and the process's peak
+    memory are recorded too.
+    """
+
+    def __init__(self, definitions, inputs=BENCHMARK_INPUTS, times=BENCHMARK_TIMES, resolutions=BENCHMARK_RESOLUTIONS,
+                 frames=5, quality='high', backend='osmesa'):
+        from offscreen import OffscreenRenderer
+        self.definitions = definitions
+        self.inputs = inputs
+        self.times = times
+        self.resolutions = resolutions
+        self.frames = frames
+        self.quality = quality
+        self.renderer = OffscreenRenderer(backend, quality=quality)
+
+    def _time_draw(self, fractal):
+        start = time.time()
+        fractal.draw()
+        gloo.finish()
+        return (time.time() - start) * 1000
+
+    def run(self):
+        self.renderer.canvas.set_current()
+        results = OrderedDict([
+            ('renderer', gloo.gl.glGetParameter(gloo.gl.GL_RENDERER)),
+            ('version', gloo.gl.glGetParameter(gloo.gl.GL_VERSION)),
+            ('quality', self.quality),
+            ('frames', self.frames),
+            ('compile', OrderedDict()),
+            ('scenes', []),
+        ])
+
+        for definition in sorted(self.definitions, key=lambda definition: definition['name']):
+            variant = (definition['distance_estimator'], definition['trap_functions'][0], COLOR_TRAP_FUNCTIONS[0])
+            compiled = len(self.renderer.fractals.compile_times)
+            fractal = self.renderer.fractals.get(definition, variant=variant)
+            # Definitions sharing a variant share its program, and only the first one compiles it
+            results['compile'][definition['name']] = sum(seconds for _, _, _, seconds in self.renderer.fractals.compile_times[compiled:]) * 1000
+
+            for width, height in self.resolutions:
+                target = RenderTarget((width, height))
+                for inputs_name, inputs in self.inputs.iteritems():
+                    for elapsed in self.times:
+                        fractal.use_definition(definition)
+                        fractal['resolution'] = (width, height)
+                        fractal['time'] = elapsed
+                        fractal.adjust(inputs)
+
+                        with target.framebuffer:
+                            gloo.set_viewport(0, 0, width, height)
+                            gloo.finish()
+                            warmup = self._time_draw(fractal)
+                            steady = np.array([self._time_draw(fractal) for frame in range(self.frames)])
+
+                        scene = OrderedDict([
+                            ('definition', definition['name']),
+                            ('inputs', inputs_name),
+                            ('time', elapsed),
+                            ('width', width),
+                            ('height', height),
+                            ('warmup_ms', warmup),
+                            ('steady_ms', float(np.median(steady))),
+                            ('steady_min_ms', float(steady.min())),
+                            ('steady_max_ms', float(steady.max())),
+                            ('peak_memory_mb', _peak_memory()),
+                        ])
+                        results['scenes'].append(scene)
+                        print "%-36s warm-up %8.1fms, steady %8.1fms" % (scene_key(scene), warmup, scene['steady_ms'])
+                target.framebuffer.delete()
+                target.texture.delete()
+
+        results['peak_memory_mb'] = _peak_memory()
+        return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Steady frame times of `results` against the same scenes in `baseline`.
+    Returns a list of (scene key, baseline ms, ms, ratio) for the scenes that
+    got more than `threshold` slower.
+    """
+    if results['renderer'] != baseline['renderer'] or results['quality'] != baseline['quality']:
+        print "Warning: comparing %s at %s quality against a baseline from %s at %s quality" % (
+            results['renderer'], results['quality'], baseline['renderer'], baseline['quality'])
+
+    baseline_scenes = dict((scene_key(scene), scene) for scene in baseline['scenes'])
+    regressions = []
+    for scene in results['scenes']:
+        key = scene_key(scene)
+        if key not in baseline_scenes:
+            print "%-36s not in the baseline" % key
+            continue
+        before = baseline_scenes[key]['steady_ms']
+        ratio = scene['steady_ms'] / before if before else float('inf')
+        flag = ' REGRESSION' if ratio > 1 + threshold else ''
+        print "%-36s %8.1fms -> %8.1fms (%+.0f%%)%s" % (key, before, scene['steady_ms'], (ratio - 1) * 100, flag)
+        if flag:
+            regressions.append((key, before, scene['steady_ms'], ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    from vispy import set_log_level
+    from definitions import Definitions
+    from gl_mode import use_gl_mode
+    from quality import QUALITY_PRESETS, DEFAULT_QUALITY
+    import sys
+    parser = OptionParser()
+    parser.add_option("-o", "--output", type="string", default="benchmark.json")
+    parser.add_option("-b", "--baseline", type="string")
+    parser.add_option("-t", "--threshold", type="float", default=REGRESSION_THRESHOLD)
+    parser.add_option("-d", "--definition", type="string", action="append")
+    parser.add_option("-r", "--resolution", type="string", action="append", metavar="WIDTHxHEIGHT")
+    parser.add_option("-n", "--frames", type="int", default=5)
+    parser.add_option("-q", "--quality", type="choice", choices=QUALITY_PRESETS.keys(), default=DEFAULT_QUALITY)
+    parser.add_option("--backend", type="string", default="osmesa")
+
+    (options, args) = parser.parse_args()
+    set_log_level('WARNING')
+    use_gl_mode('production')
+
+    resolutions = [tuple(int(side) for side in resolution.split('x')) for resolution in options.resolution] if options.resolution else BENCHMARK_RESOLUTIONS
+    definitions = [Definitions[name] for name in options.definition] if options.definition else Definitions.values()
+
+    benchmark = RenderBenchmark(definitions, resolutions=resolutions, frames=options.frames, quality=options.quality, backend=options.backend)
+    results = benchmark.run()
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print "Wrote %d scenes to %s, peak memory %.0fMB" % (len(results['scenes']), options.output, results['peak_memory_mb'])
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print "%d scenes are more than %.0f%% slower than %s" % (len(regressions), options.threshold * 100, options.baseline)
+            sys.exit(1)
+        print "No scenes are more than %.0f%% slower than %s" % (options.threshold * 100, options.baseline)
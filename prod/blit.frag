@@ -0,0 +1,22 @@
+uniform sampler2D source;
+uniform vec2 sourceSize;
+uniform float sharpness;
+uniform float gain;
+varying vec2 v_texcoord;
+
+void main() {
+  // Bilinear upscale comes from the texture's linear interpolation
+  vec3 color = texture2D(source, v_texcoord).rgb * gain;
+
+  if (sharpness > 0.0) {
+    // Unsharp mask against the four neighbouring source texels
+    vec2 texel = 1.0 / sourceSize;
+    vec3 blur = (texture2D(source, v_texcoord + vec2(texel.x, 0.0)).rgb +
+                 texture2D(source, v_texcoord - vec2(texel.x, 0.0)).rgb +
+                 texture2D(source, v_texcoord + vec2(0.0, texel.y)).rgb +
+                 texture2D(source, v_texcoord - vec2(0.0, texel.y)).rgb) * 0.25 * gain;
+    color += (color - blur) * sharpness;
+  }
+
+  gl_FragColor = vec4(clamp(color, 0.0, 1.0), 1.0);
+}
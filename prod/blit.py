@@ -0,0 +1,20 @@
+from vispy import gloo
+from utils import read_shader
+
+
+class BlitProgram(gloo.Program):
+
+    def __init__(self, source, sharpness=0.0, gain=1.0):
+        super(BlitProgram, self).__init__(read_shader('blit.vert'), read_shader('blit.frag'))
+
+        self["position"] = [(-1, -1), (-1, 1), (1, 1),
+                            (-1, -1), (1, 1), (1, -1)]
+
+        self['sharpness'] = sharpness
+        self['gain'] = gain
+        self.set_source(source)
+
+    def set_source(self, source):
+        self['source'] = source
+        height, width = source.shape[:2]
+        self['sourceSize'] = (width, height)
@@ -0,0 +1,8 @@
+attribute vec2 position;
+varying vec2 v_texcoord;
+
+void main()
+{
+    v_texcoord = (position + 1.0) / 2.0;
+    gl_Position = vec4(position, 0, 1.0);
+}
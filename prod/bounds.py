@@ -0,0 +1,119 @@
+"""
+Conservative bounding spheres for the distance estimators in fractal.frag.
+
+March() only stops where `Dist()` is below DISTANCE_MIN. For these
+estimators the iteration pushes points far from the origin further out, so
+beyond a radius that depends on the current parameters `Dist()` never gets
+that small, and rays only need to be marched where they're inside it.
+
+The folds, swaps and rotations keep the length of a point, and each scale
+and translate grows it around a fixed point, so a point |z| = r outside the
+fixed point R* stays at least R* + scale^n * (r - R*) from the origin after n
+iterations. Each radius below is where that makes every trap, or the final
+distance, at least DISTANCE_MIN.
+
+`bounding_radius` returns None where no bound is known, and then the whole
+ray is marched as before.
+"""
+import numpy as np
+from estimators import OCTO_KALEIDOSCOPE_IFS, TETRA_KALEIDOSCOPE_IFS, MANDELBOX, TRAP_NONE, TRAP_CUBE
+
+
+def _offset(params):
+    return np.array([params['iterationOffsetX'], params['iterationOffsetY'], params['iterationOffsetZ']], dtype=np.float64)
+
+
+def _kaleidoscope_radius(params, distance_min):
+    # The fixed point of z * scale - offset * (scale - 1) is the offset, and
+    # trap(z_n) * scale^-n = |z_n| * scale^-n is then at least r - |offset|
+    if params['iterationScale'] < 1:
+        return None
+    return np.linalg.norm(_offset(params)) + distance_min
+
+
+def _octo_cube_radius(params, distance_min):
+    # After the octahedral folds x is the largest of the absolute components,
+    # so x >= |z| / sqrt(3) and y, z >= 0. While angleB and angleC are between
+    # 0 and a right angle, rotating afterwards only lowers x_n to at least
+    # scale * cos(angleC) / sqrt(3) * |z_n-1| - shift, and the cube trap
+    # |x_n - trapWidth| * scale^-n has a lower bound too.
+    scale, angle_b, angle_c = params['iterationScale'], params['angleB'], params['angleC']
+    if scale < 1 or not (0 <= angle_b <= np.pi / 2) or not (0 <= angle_c < np.pi / 2):
+        return None
+    offset = _offset(params)
+    fixed = np.linalg.norm(offset)
+    translation = np.abs(offset * (scale - 1))
+    shift = np.cos(angle_c) * translation[0] + np.sin(angle_c) * (np.cos(angle_b) * translation[1] + np.sin(angle_b) * translation[2])
+    growth = np.cos(angle_c) / np.sqrt(3)
+    return fixed + (distance_min + max(0.0, shift + params['trapWidth'] - scale * growth * fixed)) / growth
+
+
+def _mandelbox_radius(params, distance_min):
+    # angleA == fixedRadius2, angleB == minRadius2, angleC == fold limit. The
+    # box fold moves each component by at most 2 * fold towards the origin,
+    # and the sphere fold leaves points outside both radii alone, where dr
+    # then grows by scale each iteration and |z_n| / dr_n >= (r - R*) * (scale - 1) / scale.
+    scale = abs(params['iterationScale'])
+    if scale <= 1:
+        return None
+    fold_shift = 2 * np.sqrt(3) * abs(params['angleC'])
+    fixed = (fold_shift * scale + np.linalg.norm(_offset(params))) / (scale - 1)
+    unfolded = fold_shift + np.sqrt(max(params['angleA'], params['angleB'], 0.0))
+    return max(fixed, unfolded, fixed + distance_min * scale / (scale - 1))
+
+
+def bounding_radius(distance_estimator, trap_function, params, distance_min):
+    """
+    Radius around the origin outside of which `Dist()` is never below
+    `distance_min` for these parameter values, or None if there's no bound.
+    """
+    if distance_estimator in (OCTO_KALEIDOSCOPE_IFS, TETRA_KALEIDOSCOPE_IFS) and trap_function == TRAP_NONE:
+        return _kaleidoscope_radius(params, distance_min)
+    elif distance_estimator == OCTO_KALEIDOSCOPE_IFS and trap_function == TRAP_CUBE:
+        return _octo_cube_radius(params, distance_min)
+    elif distance_estimator == MANDELBOX:
+        return _mandelbox_radius(params, distance_min)
+    return None
+
+
+if __name__ == '__main__':
+    # Check every bound against the NumPy estimators, on random points outside it
+    from optparse import OptionParser
+    from definitions import Definitions, parameter_values
+    from estimators import estimate
+    from input import INPUT_KEYS
+    parser = OptionParser()
+    parser.add_option("-n", "--inputs", type="int", default=200)
+    parser.add_option("-p", "--points", type="int", default=20000)
+    parser.add_option("--distance-min", type="float", default=0.01)
+    (options, args) = parser.parse_args()
+
+    random = np.random.RandomState(0)
+    failed = False
+    for name, definition in sorted(Definitions.iteritems()):
+        for trap_function in definition['trap_functions']:
+            radii = []
+            closest = np.inf
+            for sample in range(options.inputs):
+                inputs = dict((key, random.random_sample()) for key in INPUT_KEYS)
+                radius = bounding_radius(definition['distance_estimator'], trap_function, parameter_values(definition, inputs), options.distance_min)
+                if radius is None:
+                    continue
+                radii.append(radius)
+
+                # Points from just outside the sphere out to twice its radius, in every direction
+                directions = random.normal(size=(options.points, 3))
+                directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+                points = directions * (radius * (1 + random.random_sample(options.points) ** 4))[:, np.newaxis]
+                distances, _ = estimate(points, definition, inputs, time=random.random_sample() * 1000, trap_function=trap_function)
+                closest = min(closest, distances.min())
+
+            if not radii:
+                print "%s trap %d: no bound" % (name, trap_function)
+                continue
+            ok = closest >= options.distance_min
+            failed = failed or not ok
+            print "%s trap %d: %d bounded, radius %.2f-%.2f, closest distance outside %.4f %s" % (
+                name, trap_function, len(radii), min(radii), max(radii), closest, 'ok' if ok else 'FAILED')
+    if failed:
+        raise SystemExit(1)
@@ -1,26 +1,127 @@
+from filters import FILTER_DEFAULTS
+import difflib
 import yaml
 import os.path
 
-with open(os.path.join(os.path.dirname(__file__), 'fractal_definitions.yml'), 'r') as f:
-    _definitions = yaml.load(f)
+DEFINITIONS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fractal_definitions.yml')
 
-Definitions = {}
+DEFINITION_KEYS = ('distance_estimator', 'trap_functions', 'params', 'filter')
+REQUIRED_DEFINITION_KEYS = ('distance_estimator', 'trap_functions', 'params')
+PARAM_KEYS = ('min', 'max', 'initial')
 
-for name, input_definition in _definitions.iteritems():
-    definition = {
-        'name': name,
-        'distance_estimator': input_definition['distance_estimator'],
-        'trap_functions': input_definition['trap_functions'],
-        'params': {}
-    }
 
-    for param, param_description in input_definition['params'].iteritems():
-        definition['params'][param] = {
-            'min': param_description['min'] if isinstance(param_description, dict) else param_description,
-            'max': param_description['max'] if isinstance(param_description, dict) else param_description,
-            'initial': param_description.get('initial', param_description['min']) if isinstance(param_description, dict) else param_description
+class DefinitionError(Exception):
+    pass
+
+
+def _unknown_key(where, key, known):
+    suggestions = difflib.get_close_matches(str(key), known, n=1)
+    return "%s: unknown key %r%s" % (where, key, " (did you mean %r?)" % suggestions[0] if suggestions else "")
+
+
+def validate_definition(name, input_definition):
+    """ Problems with a definition as parsed from the YAML, as a list of messages. """
+    if not isinstance(input_definition, dict):
+        return ["%s: expected a mapping of settings" % name]
+
+    problems = [_unknown_key(name, key, DEFINITION_KEYS) for key in input_definition if key not in DEFINITION_KEYS]
+    problems += ["%s: missing %s" % (name, key) for key in REQUIRED_DEFINITION_KEYS if key not in input_definition]
+
+    if not isinstance(input_definition.get('trap_functions', []), list) or not input_definition.get('trap_functions', [None]):
+        problems.append("%s: trap_functions should be a list of at least one trap function" % name)
+
+    for key, setting in input_definition.get('filter', {}).iteritems():
+        if key not in FILTER_DEFAULTS:
+            problems.append(_unknown_key("%s filter" % name, key, FILTER_DEFAULTS.keys()))
+
+    params = input_definition.get('params', {})
+    if not isinstance(params, dict):
+        return problems + ["%s: params should be a mapping of parameters" % name]
+    for param, param_description in params.iteritems():
+        where = "%s.%s" % (name, param)
+        if not isinstance(param_description, dict):
+            if not isinstance(param_description, (int, float)):
+                problems.append("%s: expected a number or min and max" % where)
+            continue
+
+        problems += [_unknown_key(where, key, PARAM_KEYS) for key in param_description if key not in PARAM_KEYS]
+        if 'min' not in param_description or 'max' not in param_description:
+            problems.append("%s: missing min or max" % where)
+        elif param_description['min'] > param_description['max']:
+            problems.append("%s: min is more than max" % where)
+        elif 'initial' in param_description and not param_description['min'] <= param_description['initial'] <= param_description['max']:
+            problems.append("%s: initial %s is outside min %s and max %s" % (
+                where, param_description['initial'], param_description['min'], param_description['max']))
+    return problems
+
+
+def load_definitions(path=DEFINITIONS_PATH):
+    """
+    Parse and validate the definitions file into {name: definition}. Raises
+    DefinitionError listing every problem found, rather than ignoring
+    misspelt keys.
+    """
+    try:
+        with open(path, 'r') as f:
+            input_definitions = yaml.load(f)
+    except (IOError, yaml.YAMLError) as e:
+        raise DefinitionError("Couldn't read %s: %s" % (path, e))
+
+    if not isinstance(input_definitions, dict) or not input_definitions:
+        raise DefinitionError("%s has no definitions" % path)
+    problems = [problem for name, input_definition in sorted(input_definitions.iteritems()) for problem in validate_definition(name, input_definition)]
+    if problems:
+        raise DefinitionError("Invalid definitions in %s:\n  %s" % (path, "\n  ".join(problems)))
+
+    definitions = {}
+    for name, input_definition in input_definitions.iteritems():
+        definition = {
+            'name': name,
+            'distance_estimator': input_definition['distance_estimator'],
+            'trap_functions': input_definition['trap_functions'],
+            # Optional OneEuroFilter settings for the inputs, see filters.py
+            'filter': input_definition.get('filter', {}),
+            'params': {}
         }
 
-        definition['params'][param]['delta'] = definition['params'][param]['max'] - definition['params'][param]['min']
+        for param, param_description in input_definition['params'].iteritems():
+            definition['params'][param] = {
+                'min': param_description['min'] if isinstance(param_description, dict) else param_description,
+                'max': param_description['max'] if isinstance(param_description, dict) else param_description,
+                'initial': param_description.get('initial', param_description['min']) if isinstance(param_description, dict) else param_description
+            }
+
+            definition['params'][param]['delta'] = definition['params'][param]['max'] - definition['params'][param]['min']
+
+        definitions[name] = definition
+    return definitions
+
+
+Definitions = load_definitions()
+
+
+def reload_definitions(path=DEFINITIONS_PATH):
+    """
+    Re-parse the definitions file into `Definitions` in place, so every module
+    that imported it sees the change. If the file is invalid DefinitionError
+    is raised and `Definitions` is left as it was.
+    """
+    definitions = load_definitions(path)
+    Definitions.clear()
+    Definitions.update(definitions)
+    return Definitions
+
 
-    Definitions[name] = definition
+def parameter_values(definition, adjustments):
+    """
+    Map normalized 0..1 adjustments onto a definition's parameter ranges, the
+    same way `FractalProgram.adjust` does. Parameters without an adjustment
+    keep their initial value.
+    """
+    values = {}
+    for param, param_description in definition['params'].iteritems():
+        if param in adjustments:
+            values[param] = param_description['min'] + param_description['delta'] * adjustments[param]
+        else:
+            values[param] = param_description['initial']
+    return values
@@ -0,0 +1,9 @@
+uniform sampler2D depth;
+uniform float maxDepth;
+varying vec2 v_texcoord;
+
+void main() {
+  // r16 textures sample as millimetres / 65535
+  float millimetres = texture2D(depth, v_texcoord).r * 65535.0;
+  gl_FragColor = vec4(vec3(clamp(millimetres / maxDepth, 0.0, 1.0)), 1.0);
+}
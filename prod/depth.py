@@ -0,0 +1,113 @@
+from vispy import gloo
+import numpy as np
+import pickle
+from utils import read_shader
+
+DEPTH_SHAPE = (480, 640)
+
+
+def depth_view(frame):
+    """
+    A (height, width) uint16 array of millimetres viewing an OpenNI depth
+    frame's buffer without copying it. It's only valid while the frame is.
+    """
+    buffer = np.ctypeslib.as_array(frame.get_buffer_as_uint16())
+    return buffer.reshape(frame.height, frame.width)
+
+
+def load_depth_pickle(path):
+    """ A uint16 view of a pickled (height, width, 2) array of get_buffer_as_uint8 bytes, like test-data/np_depth_frame.pickle. """
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    return np.ascontiguousarray(data, dtype=np.uint8).view('<u2')[..., 0]
+
+
+class DepthTexture(object):
+    """
+    A persistent single channel 16 bit texture of depth frames. Frames are
+    uploaded in place with sub-image updates straight from the uint16 arrays,
+    with rows in the order the sensor gives them, so the texture is upside
+    down and samplers flip it with their texture coordinates instead (see
+    depth.vert). Sampled values are millimetres / 65535.
+    """
+
+    def __init__(self, shape=DEPTH_SHAPE):
+        self.texture = gloo.Texture2D(shape=shape + (1,), format='luminance', internalformat='r16', interpolation='nearest')
+        self.frame = None
+
+    @property
+    def shape(self):
+        return self.texture.shape[:2]
+
+    def update(self, depth):
+        """ Upload a (height, width) uint16 array, the texture is resized if it's a different size. """
+        if depth.shape != self.shape:
+            self.texture.resize(depth.shape + (1,))
+        self.texture.set_data(depth[..., np.newaxis], offset=(0, 0))
+
+    def update_frame(self, frame):
+        """ Upload an OpenNI depth frame, keeping it alive until the next one so the upload can read its buffer. """
+        self.frame = frame
+        self.update(depth_view(frame))
+
+
+class DepthProgram(gloo.Program):
+    """ Shows a `DepthTexture` in greyscale, black near and white at `max_depth` millimetres and beyond. """
+
+    def __init__(self, depth, max_depth=4000.0):
+        super(DepthProgram, self).__init__(read_shader('depth.vert'), read_shader('depth.frag'))
+
+        self["position"] = [(-1, -1), (-1, 1), (1, 1),
+                            (-1, -1), (1, 1), (1, -1)]
+
+        self['depth'] = depth.texture
+        self['maxDepth'] = max_depth
+
+
+if __name__ == '__main__':
+    # Checks the depth texture against the pickled frame, and times uploads compared with the
+    # luminance_alpha copies attempts/depth_video.py does
+    from optparse import OptionParser
+    from vispy import app
+    import os.path
+    import time
+    parser = OptionParser()
+    parser.add_option("-p", "--pickle", type="string", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'test-data', 'np_depth_frame.pickle'))
+    parser.add_option("-n", "--frames", type="int", default=200)
+    parser.add_option("--app", type="string")
+    (options, args) = parser.parse_args()
+
+    depth = load_depth_pickle(options.pickle)
+    raw = np.ascontiguousarray(depth).view(np.uint8).reshape(depth.shape + (2,))
+    print "Depth frame %dx%d, %d..%d mm" % (depth.shape[1], depth.shape[0], depth.min(), depth.max())
+
+    canvas = app.Canvas(app=options.app, size=depth.shape[::-1], show=False)
+    canvas.set_current()
+    texture = DepthTexture(depth.shape)
+    program = DepthProgram(texture, max_depth=float(depth.max()))
+    target = gloo.FrameBuffer(gloo.Texture2D(shape=depth.shape + (4,)))
+
+    texture.update(depth)
+    with target:
+        gloo.set_viewport(0, 0, depth.shape[1], depth.shape[0])
+        program.draw()
+        image = target.read()
+    expected = np.clip(depth / float(depth.max()), 0, 1) * 255
+    error = np.abs(image[..., 0].astype(np.float64) - expected).max()
+    print "Largest difference from the frame: %.1f/255" % error
+    assert error <= 1.0, "depth texture doesn't match the frame"
+
+    old_texture = gloo.Texture2D(shape=depth.shape + (2,), format='luminance_alpha')
+
+    def copied():
+        frame_data = np.array(raw, dtype=np.uint8)
+        frame_data.shape = depth.shape + (2,)
+        old_texture.set_data(frame_data[::-1])
+
+    for label, upload in (('copied luminance_alpha', copied), ('uint16 view', lambda: texture.update(depth))):
+        start = time.time()
+        for i in range(options.frames):
+            upload()
+            canvas.context.flush_commands()
+        gloo.finish()
+        print "%s: %.2fms per frame" % (label, (time.time() - start) / options.frames * 1000)
@@ -0,0 +1,9 @@
+attribute vec2 position;
+varying vec2 v_texcoord;
+
+void main()
+{
+    // Depth rows are stored top first, so the texture is flipped here instead of on upload
+    v_texcoord = vec2(position.x + 1.0, 1.0 - position.y) / 2.0;
+    gl_Position = vec4(position, 0, 1.0);
+}
@@ -0,0 +1,227 @@
+"""
+NumPy ports of the distance estimators in fractal.frag.
+
+Every function here works on a whole batch of points at once: pass an (N, 3)
+array and get back an (N,) array of distances plus an (N, 3) array of colour
+trap values, matching what `Dist()` computes per fragment on the GPU.
+"""
+import numpy as np
+from definitions import parameter_values
+
+
+# Same numbering as the `distance_estimator`, `trap_functions` and
+# `colorTrapFunction` values used by fractal_definitions.yml and fractal.frag
+OCTO_KALEIDOSCOPE_IFS = 1
+TETRA_KALEIDOSCOPE_IFS = 2
+MANDELBOX = 3
+
+TRAP_NONE = 1
+TRAP_CUBE = 2
+TRAP_TUBE = 3
+
+COLOR_TRAP_AXIS_DISTANCE = 1
+COLOR_TRAP_AXIS_PROXIMITY = 2
+COLOR_TRAP_NORMALIZED = 3
+
+
+def _rotate(a, b, angle):
+    # rotate() from fractal.frag, in place on a pair of component arrays
+    c, s = np.cos(angle), np.sin(angle)
+    a_rotated = c * a + s * b
+    b[:] = -s * a + c * b
+    a[:] = a_rotated
+
+
+def _swap_where(mask, a, b, negate):
+    # z.ab = -z.ba (or z.ba) only for the points where mask holds
+    a_masked = a[mask]
+    if negate:
+        a[mask] = -b[mask]
+        b[mask] = -a_masked
+    else:
+        a[mask] = b[mask]
+        b[mask] = a_masked
+
+
+def _trap(trap_function, x, y, z, params):
+    if trap_function == TRAP_NONE:
+        return np.sqrt(x * x + y * y + z * z)
+    elif trap_function == TRAP_CUBE:
+        return np.abs(x - params['trapWidth'])
+    elif trap_function == TRAP_TUBE:
+        return np.hypot(x - params['trapWidth'], z - params['trapWidth']) - 0.05
+    raise ValueError("Unknown trap function %s" % trap_function)
+
+
+def _color_trap(color_trap_function, trap_distance, iteration_factor, x, y, z):
+    p = np.column_stack((x, y, z))
+    if color_trap_function == COLOR_TRAP_AXIS_DISTANCE:
+        np.minimum(trap_distance, p * iteration_factor, out=trap_distance)
+    elif color_trap_function == COLOR_TRAP_AXIS_PROXIMITY:
+        with np.errstate(divide='ignore'):
+            np.maximum(trap_distance, 1 / p, out=trap_distance)
+    elif color_trap_function == COLOR_TRAP_NORMALIZED:
+        norm = np.sqrt((p * p).sum(axis=1))[:, np.newaxis]
+        norm[norm == 0] = 1
+        np.minimum(trap_distance, p / norm, out=trap_distance)
+    else:
+        raise ValueError("Unknown color trap function %s" % color_trap_function)
+
+
+def _iterations(params):
+    # GLSL compares the int loop counter against the float uniform
+    return int(np.ceil(params['iterations']))
+
+
+def octo_kaleidoscope_ifs(x, y, z, params, trap_function, color_trap_function):
+    n_points = len(x)
+    point_distance = np.full(n_points, 1000.0, dtype=np.float32)
+    trap_distance = np.full((n_points, 3), 1000.0, dtype=np.float32)
+    scale = params['iterationScale']
+    offset = [params['iterationOffset%s' % axis] * (scale - 1.0) for axis in 'XYZ']
+
+    for n in range(_iterations(params)):
+        _rotate(x, z, params['angleA'])
+        # This is octahedral symmetry,
+        # with some 'abs' functions thrown in for good measure.
+        _swap_where(x + y < 0, x, y, negate=True)
+        np.abs(x, out=x), np.abs(y, out=y), np.abs(z, out=z)
+        _swap_where(x + z < 0, x, z, negate=True)
+        np.abs(x, out=x), np.abs(y, out=y), np.abs(z, out=z)
+        _swap_where(x - y < 0, x, y, negate=False)
+        np.abs(x, out=x), np.abs(y, out=y), np.abs(z, out=z)
+        _swap_where(x - z < 0, x, z, negate=False)
+        x *= scale
+        x -= offset[0]
+        y *= scale
+        y -= offset[1]
+        z *= scale
+        z -= offset[2]
+        _rotate(y, z, params['angleB'])
+        _rotate(x, y, params['angleC'])
+
+        iteration_factor = scale ** -float(n + 1)
+        _color_trap(color_trap_function, trap_distance, iteration_factor, x, y, z)
+        np.minimum(point_distance, _trap(trap_function, x, y, z, params) * iteration_factor, out=point_distance)
+
+    return point_distance, trap_distance
+
+
+def tetra_kaleidoscope_ifs(x, y, z, params, trap_function, color_trap_function):
+    n_points = len(x)
+    point_distance = np.full(n_points, 1000.0, dtype=np.float32)
+    trap_distance = np.full((n_points, 3), 1000.0, dtype=np.float32)
+    scale = params['iterationScale']
+    offset = [params['iterationOffset%s' % axis] * (scale - 1.0) for axis in 'XYZ']
+
+    for n in range(_iterations(params)):
+        _rotate(x, z, params['angleA'])
+        # Tetrahedral symmetry from http://www.fractalforums.com/ifs-iterated-function-systems/kaleidoscopic-(escape-time-ifs)/
+        _swap_where(x + y < 0, x, y, negate=True)
+        _swap_where(x + z < 0, x, z, negate=True)
+        _swap_where(y + z < 0, z, y, negate=True)
+
+        x *= scale
+        x -= offset[0]
+        y *= scale
+        y -= offset[1]
+        z *= scale
+        z -= offset[2]
+        _rotate(x, y, params['angleB'])
+
+        iteration_factor = scale ** -float(n + 1)
+        _color_trap(color_trap_function, trap_distance, iteration_factor, x, y, z)
+        np.minimum(point_distance, _trap(trap_function, x, y, z, params) * iteration_factor, out=point_distance)
+
+    return point_distance, trap_distance
+
+
+def mandelbox(x, y, z, params, trap_function, color_trap_function):
+    # angleA == fixedRadius2, angleB == minRadius2, angleC == fold limit
+    n_points = len(x)
+    trap_distance = np.full((n_points, 3), 1000.0, dtype=np.float32)
+    dr = np.ones(n_points, dtype=np.float32)
+    scale = params['iterationScale']
+    fixed_radius2, min_radius2, fold = params['angleA'], params['angleB'], params['angleC']
+
+    for n in range(_iterations(params)):
+        # Reflect
+        for component in (x, y, z):
+            component[:] = np.clip(component, -fold, fold) * 2.0 - component
+
+        # Sphere Inversion
+        r2 = x * x + y * y + z * z
+        factor = np.where(r2 < min_radius2, fixed_radius2 / min_radius2,
+                          np.where(r2 < fixed_radius2, fixed_radius2 / np.maximum(r2, 1e-10), 1.0)).astype(np.float32)
+        x *= factor
+        y *= factor
+        z *= factor
+        dr *= factor
+
+        # Scale & Translate
+        x *= scale
+        x += params['iterationOffsetX']
+        y *= scale
+        y += params['iterationOffsetY']
+        z *= scale
+        z += params['iterationOffsetZ']
+        dr *= abs(scale)
+        dr += 1.0
+
+        iteration_factor = scale ** -float(n + 1)
+        _color_trap(color_trap_function, trap_distance, iteration_factor, x, y, z)
+
+    return np.sqrt(x * x + y * y + z * z) / np.abs(dr), trap_distance
+
+
+ESTIMATORS = {
+    OCTO_KALEIDOSCOPE_IFS: octo_kaleidoscope_ifs,
+    TETRA_KALEIDOSCOPE_IFS: tetra_kaleidoscope_ifs,
+    MANDELBOX: mandelbox,
+}
+
+
+def estimate(points, definition, inputs=None, time=0.0, trap_function=None, color_trap_function=COLOR_TRAP_AXIS_DISTANCE):
+    """
+    Evaluate a definition's distance estimator for a batch of points.
+
+    `points` is an (N, 3) array in the same world space `Dist()` gets, and
+    `inputs` the normalized 0..1 values `FractalProgram.adjust` is given.
+    Parameters missing from `inputs` use the definition's initial value. The
+    trap function defaults to the first one listed by the definition.
+
+    Returns a tuple of (N,) distances and (N, 3) colour trap values.
+    """
+    points = np.asarray(points, dtype=np.float32)
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise ValueError("Expected an (N, 3) array of points, got shape %s" % (points.shape, ))
+
+    params = parameter_values(definition, inputs or {})
+    if trap_function is None:
+        trap_function = definition['trap_functions'][0]
+
+    # Dist() rotates the whole fractal slowly about the Y axis over time.
+    # Columns are copied out so the estimators can work on them in place.
+    x, z = points[:, 0].copy(), points[:, 2].copy()
+    _rotate(x, z, time * 0.025)
+    y = points[:, 1].copy()
+
+    return ESTIMATORS[definition['distance_estimator']](x, y, z, params, trap_function, color_trap_function)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    from definitions import Definitions
+    import timeit
+
+    parser = OptionParser()
+    parser.add_option("-n", "--points", type="int", default=100000)
+    parser.add_option("-r", "--repeat", type="int", default=5)
+    (options, args) = parser.parse_args()
+
+    points = (np.random.random((options.points, 3)).astype(np.float32) - 0.5) * 10
+    inputs = {param: 0.5 for param in ('angleA', 'angleB', 'angleC', 'iterationScale', 'iterationOffsetX', 'iterationOffsetY', 'iterationOffsetZ', 'trapWidth')}
+
+    for name, definition in sorted(Definitions.iteritems()):
+        seconds = min(timeit.repeat(lambda: estimate(points, definition, inputs), number=1, repeat=options.repeat))
+        print "%s: %d points in %.3fs, %.0f points/second" % (name, options.points, seconds, options.points / seconds)
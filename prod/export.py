@@ -0,0 +1,209 @@
+from Queue import Queue
+import numpy as np
+import os
+import sys
+import threading
+from vispy.io import write_png
+
+Y4M_COLORSPACE = 'C420jpeg'
+
+
+class PNGSequenceWriter(object):
+    """ Writes each frame to its own numbered PNG in `directory`. """
+
+    def __init__(self, directory, pattern='frame%06d.png'):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, pattern)
+
+    def encode(self, index, image):
+        write_png(self.path % index, image)
+
+    def write(self, index, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def rgb_to_yuv420(image):
+    """ Full range BT.601 planes of an (height, width, 3 or 4) uint8 image with even sides, in integer maths so it's exact. """
+    rgb = image[..., :3].astype(np.int32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    y = (77 * r + 150 * g + 29 * b + 128) >> 8
+
+    # Chroma of each 2x2 block's average
+    height, width = r.shape
+    blocks = rgb.reshape(height // 2, 2, width // 2, 2, 3).sum(axis=(1, 3))
+    r, g, b = blocks[..., 0], blocks[..., 1], blocks[..., 2]
+    u = ((-43 * r - 85 * g + 128 * b + 512) >> 10) + 128
+    v = ((128 * r - 107 * g - 21 * b + 512) >> 10) + 128
+    return [np.clip(plane, 0, 255).astype(np.uint8) for plane in (y, u, v)]
+
+
+class Y4MWriter(object):
+    """
+    Writes frames as an uncompressed YUV4MPEG2 stream to `output`, a path or
+    '-' for stdout, e.g. to pipe into `ffmpeg -i - video.mp4`.
+    """
+
+    def __init__(self, output, size, fps):
+        width, height = size
+        if width % 2 or height % 2:
+            raise ValueError("4:2:0 video needs an even width and height, not %dx%d" % size)
+        self.file = os.fdopen(os.dup(sys.stdout.fileno()), 'wb') if output == '-' else open(output, 'wb')
+        self.file.write('YUV4MPEG2 W%d H%d F%d:1 Ip A1:1 %s\n' % (width, height, fps, Y4M_COLORSPACE))
+
+    def encode(self, index, image):
+        return 'FRAME\n' + ''.join(plane.tostring() for plane in rgb_to_yuv420(image))
+
+    def write(self, index, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+class FrameWriterPool(object):
+    """
+    Encodes frames on `workers` threads while the next ones render. Frames
+    are handed over through a queue of at most `queue_size`, so rendering
+    waits for the encoders instead of piling frames up in memory. Encoded
+    frames are passed to the writer's `write` in frame order, whichever
+    worker finishes first. An encoder error is raised from the next `put`
+    or `close`.
+    """
+
+    def __init__(self, writer, workers=2, queue_size=8):
+        self.writer = writer
+        self.queue = Queue(maxsize=queue_size)
+        self.error = None
+        self._lock = threading.Lock()
+        self._encoded = {}
+        self._next = 0
+
+        self.threads = [threading.Thread(target=self._work) for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            index, image = item
+            try:
+                data = self.writer.encode(index, image)
+                with self._lock:
+                    self._encoded[index] = data
+                    while self._next in self._encoded:
+                        self.writer.write(self._next, self._encoded.pop(self._next))
+                        self._next += 1
+            except Exception as e:
+                self.error = e
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, index, image):
+        self._check()
+        self.queue.put((index, image))
+
+    def close(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.writer.close()
+        self._check()
+
+
+def export(input_manager, definition, size, frames, fps=60, start_time=0.0, writer=None, backend='osmesa', passes=1, quality=None, workers=2, seed=0):
+    """
+    Render `frames` frames of `definition` at a fixed `fps`, stepping the
+    inputs and time by exactly 1 / fps from `start_time` however long each
+    frame takes to render, and hand them to `writer`. The trap function is
+    picked from `seed`, so the same arguments give the same frames.
+    """
+    from fractal import choose_variant
+    from offscreen import OffscreenRenderer
+    from quality import DEFAULT_QUALITY
+    import random
+    import time
+
+    random.seed(seed)
+    variant = choose_variant(definition)
+    renderer = OffscreenRenderer(backend, quality=quality or DEFAULT_QUALITY)
+    pool = FrameWriterPool(writer, workers=workers)
+
+    started = time.time()
+    try:
+        for frame in range(frames):
+            elapsed = start_time + frame / float(fps)
+            input_manager.time = elapsed
+            inputs = input_manager.inputs(elapsed) or {}
+            pool.put(frame, renderer.render_still(definition, inputs, elapsed, size, passes=passes, variant=variant))
+    finally:
+        pool.close()
+    seconds = time.time() - started
+    print "Exported %d frames of %s in %.1fs, %.1f frames/second" % (frames, definition['name'], seconds, frames / max(seconds, 1e-9))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    from vispy import set_log_level
+    from definitions import Definitions
+    from gl_mode import use_gl_mode
+    from input import FakeInput, FileStoredInput, ReplayInput
+    from quality import QUALITY_PRESETS, DEFAULT_QUALITY
+    parser = OptionParser(usage="%prog [options] OUTPUT, a directory of PNGs, or a .y4m file or - for y4m on stdout")
+    parser.add_option("-W", "--width", type="int", default=800)
+    parser.add_option("-H", "--height", type="int", default=600)
+    parser.add_option("-s", "--seconds", type="float", default=10)
+    parser.add_option("--fps", type="int", default=60)
+    parser.add_option("--start", type="float")
+    parser.add_option("-d", "--definition", type="string")
+    parser.add_option("-l", "--path", type="string")
+    parser.add_option("-r", "--replay", type="string", metavar="PATH")
+    parser.add_option("--backend", type="string", default="osmesa")
+    parser.add_option("-p", "--progressive", type="int", default=0)
+    parser.add_option("-q", "--quality", type="choice", choices=QUALITY_PRESETS.keys(), default=DEFAULT_QUALITY)
+    parser.add_option("-j", "--workers", type="int", default=2)
+    parser.add_option("--seed", type="int", default=0)
+
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected an output")
+    output = args[0]
+    if output == '-':
+        # The video goes to stdout, so everything printed goes to stderr instead
+        writer = Y4MWriter(output, (options.width, options.height), options.fps)
+        sys.stdout = sys.stderr
+    elif output.endswith('.y4m'):
+        writer = Y4MWriter(output, (options.width, options.height), options.fps)
+    else:
+        writer = PNGSequenceWriter(output)
+
+    set_log_level('WARNING')
+    use_gl_mode('production')
+
+    start_time = 0.0
+    definition_name = sorted(Definitions.keys())[0]
+    if options.path:
+        input_manager = FileStoredInput(options.path)
+        start_time = input_manager.stored_time
+        definition_name = input_manager.stored_definition_name
+    elif options.replay:
+        input_manager = ReplayInput(options.replay)
+    else:
+        input_manager = FakeInput()
+    if options.start is not None:
+        start_time = options.start
+    definition = Definitions[options.definition or definition_name]
+    input_manager.configure_filter(definition['filter'])
+
+    export(input_manager, definition, (options.width, options.height), int(round(options.seconds * options.fps)), fps=options.fps,
+           start_time=start_time, writer=writer, backend=options.backend, passes=max(options.progressive, 1), quality=options.quality,
+           workers=options.workers, seed=options.seed)
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+import numpy as np
+from sensor import JointType as JT, JOINT_COUNT, MIN_CONFIDENCE
+
+# (root, appendage, appendage) joints of the angle each input follows
+JOINT_ANGLES = OrderedDict([
+    ('angleB', (JT.NITE_JOINT_RIGHT_ELBOW, JT.NITE_JOINT_RIGHT_SHOULDER, JT.NITE_JOINT_RIGHT_HAND)),
+    ('angleC', (JT.NITE_JOINT_LEFT_ELBOW, JT.NITE_JOINT_LEFT_SHOULDER, JT.NITE_JOINT_LEFT_HAND)),
+    ('iterationScale', (JT.NITE_JOINT_LEFT_SHOULDER, JT.NITE_JOINT_LEFT_HIP, JT.NITE_JOINT_LEFT_ELBOW)),
+    ('iterationOffsetX', (JT.NITE_JOINT_RIGHT_SHOULDER, JT.NITE_JOINT_RIGHT_HIP, JT.NITE_JOINT_RIGHT_ELBOW)),
+    ('iterationOffsetY', (JT.NITE_JOINT_RIGHT_SHOULDER, JT.NITE_JOINT_RIGHT_HIP, JT.NITE_JOINT_RIGHT_ELBOW)),
+    ('iterationOffsetZ', (JT.NITE_JOINT_RIGHT_SHOULDER, JT.NITE_JOINT_RIGHT_HIP, JT.NITE_JOINT_RIGHT_ELBOW)),
+    ('trapWidth', (JT.NITE_JOINT_RIGHT_ELBOW, JT.NITE_JOINT_RIGHT_SHOULDER, JT.NITE_JOINT_RIGHT_HAND)),
+])
+
+# (from joint, to joint, plane normal) of the line whose angle to a plane each input follows
+LINE_ANGLES = OrderedDict([
+    ('angleA', (JT.NITE_JOINT_LEFT_ELBOW, JT.NITE_JOINT_RIGHT_ELBOW, (0, 0, 1))),
+])
+
+# Joints whose distance apart is measured, none of the inputs currently follow one
+JOINT_DISTANCES = OrderedDict()
+
+
+class JointFeatures(object):
+    """
+    Computes every feature of a user's joints from their (15, 3) positions
+    and (15,) confidences in one batched NumPy expression. Each feature is
+    the angle or length of a pair of vectors between rows of the positions,
+    with the plane normals appended as extra rows, and features of the same
+    joints are only computed once.
+    """
+
+    def __init__(self, joint_angles=JOINT_ANGLES, line_angles=LINE_ANGLES, distances=JOINT_DISTANCES):
+        self.names = joint_angles.keys() + line_angles.keys() + distances.keys()
+
+        # Plane normals go after the joints, followed by the origin
+        normals = [tuple(normal) for normal in sorted(set(joints[2] for joints in line_angles.values()))]
+        self._normals = np.array(normals, dtype=np.float64).reshape(-1, 3)
+        origin = JOINT_COUNT + len(normals)
+
+        # Each feature measures (p[j1] - p[j0]) against (p[j2] - p[j3])
+        pairs = [(root, a, b, root) for root, a, b in joint_angles.values()] + \
+                [(start, end, JOINT_COUNT + normals.index(tuple(normal)), origin) for start, end, normal in line_angles.values()] + \
+                [(a, b, b, a) for a, b in distances.values()]
+        unique_pairs = sorted(set(pairs))
+        self._joints = np.array(unique_pairs, dtype=np.intp).T
+        self._feature_index = np.array([unique_pairs.index(pair) for pair in pairs], dtype=np.intp)
+
+        kinds = np.array([0] * len(joint_angles) + [1] * len(line_angles) + [2] * len(distances))
+        self._lines = kinds == 1
+        self._distances = kinds == 2
+
+    def __call__(self, positions, confidences):
+        """ {name: value} for every feature, with None for features of joints below MIN_CONFIDENCE. """
+        points = np.concatenate((positions, self._normals, np.zeros((1, 3))))
+        confident = np.concatenate((confidences >= MIN_CONFIDENCE, np.ones(len(self._normals) + 1, dtype=bool)))
+
+        vectors = points[self._joints]
+        u = vectors[1] - vectors[0]
+        v = vectors[2] - vectors[3]
+        dots = np.einsum('kij,kij->ki', np.array((u, v, u)), np.array((u, v, v)))
+        lengths = np.sqrt(dots[0])
+
+        # inverse of cosine law -- isolate the angle in the dot product formula. The angle of a
+        # line to a plane is a quarter turn less than its angle to the plane's normal.
+        # http://www.vitutor.com/geometry/distance/line_plane.html
+        with np.errstate(invalid='ignore', divide='ignore'):
+            angles = np.arccos(np.clip(dots[2] / (lengths * np.sqrt(dots[1])), -1, 1)) / np.pi
+
+        values = np.where(self._distances, lengths[self._feature_index], angles[self._feature_index])
+        values[self._lines] = 0.5 - values[self._lines]
+        valid = confident[self._joints].all(axis=0)[self._feature_index] & np.isfinite(values)
+        return dict(zip(self.names, [value if ok else None for value, ok in zip(values.tolist(), valid.tolist())]))
+
+
+if __name__ == '__main__':
+    # Per frame cost of the features, compared with computing each input on its own like SkeletonInput used to
+    import timeit
+    from utils import LowConfidenceException
+
+    rng = np.random.RandomState(0)
+    positions = rng.rand(15, 3) * 1000
+    confidences = np.where(rng.rand(15) < 0.9, 0.9, 0.1)
+
+    def joint(joint_type):
+        if confidences[joint_type] < MIN_CONFIDENCE:
+            raise LowConfidenceException
+        return np.asarray(positions[joint_type].tolist())
+
+    def joint_angle(root, appendage_a, appendage_b):
+        root = joint(root)
+        a = joint(appendage_a) - root
+        b = joint(appendage_b) - root
+        return np.arccos(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))) / np.pi
+
+    def line_angle(joint_a, joint_b, plane_normal):
+        line = joint(joint_b) - joint(joint_a)
+        return np.arcsin(np.dot(line, plane_normal) / (np.linalg.norm(line) * np.linalg.norm(plane_normal))) / np.pi
+
+    def per_input():
+        features = {}
+        for name, getter in [(name, lambda joints=joints: joint_angle(*joints)) for name, joints in JOINT_ANGLES.items()] + \
+                            [(name, lambda joints=joints: line_angle(joints[0], joints[1], np.array(joints[2]))) for name, joints in LINE_ANGLES.items()] + \
+                            [(name, lambda joints=joints: np.linalg.norm(joint(joints[0]) - joint(joints[1]))) for name, joints in JOINT_DISTANCES.items()]:
+            try:
+                features[name] = getter()
+            except LowConfidenceException:
+                features[name] = None
+        return features
+
+    batched = JointFeatures()
+    expected, actual = per_input(), batched(positions, confidences)
+    assert all((expected[name] is None) == (actual[name] is None) for name in expected)
+    assert all(abs(expected[name] - actual[name]) < 1e-9 for name in expected if expected[name] is not None)
+
+    for label, function in (('per input', per_input), ('batched', lambda: batched(positions, confidences))):
+        seconds = min(timeit.repeat(function, number=2000, repeat=3)) / 2000
+        print "%s: %.1fus per frame" % (label, seconds * 1e6)
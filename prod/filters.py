@@ -0,0 +1,85 @@
+import numpy as np
+
+# Defaults for inputs in the 0..1 range, see OneEuroFilter
+FILTER_DEFAULTS = {
+    'min_cutoff': 1.0,
+    'beta': 4.0,
+    'derivative_cutoff': 1.0,
+    'extrapolate': 0.0,
+}
+
+# Extrapolation never reaches further than this past the last update, in seconds
+MAX_EXTRAPOLATION = 0.1
+
+
+def _smoothing_factor(dt, cutoff):
+    tau = 1.0 / (2 * np.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class OneEuroFilter(object):
+    """
+    One euro filters (Casiez, Roussel and Vogel 2012) for a fixed list of
+    `keys`, with the state of all of them kept in arrays. Each is a low pass
+    filter whose cutoff rises from `min_cutoff` Hz with the speed of the
+    input times `beta`, so slow movements are smoothed heavily and fast
+    ones follow with little lag. The speed is itself low passed at
+    `derivative_cutoff` Hz.
+
+    With `extrapolate` seconds the output is projected ahead along the
+    filtered speed, to make up for the sensor and render latency. Each
+    setting can be a single value or a {key: value} dict.
+    """
+
+    def __init__(self, keys, **settings):
+        self.keys = list(keys)
+        for name, default in FILTER_DEFAULTS.iteritems():
+            setattr(self, name, np.full(len(self.keys), default, dtype=np.float64))
+        self.configure(**settings)
+        self.reset()
+
+    def configure(self, **settings):
+        """ Change the given settings, a {key: value} setting only changes the keys it has. """
+        for name, setting in settings.iteritems():
+            values = getattr(self, name)
+            if isinstance(setting, dict):
+                for key, value in setting.iteritems():
+                    if key in self.keys:
+                        values[self.keys.index(key)] = value
+            else:
+                values[:] = setting
+
+    def reset(self):
+        self.value = np.zeros(len(self.keys))
+        self.derivative = np.zeros(len(self.keys))
+        self._seen = np.zeros(len(self.keys), dtype=bool)
+        self._time = None
+
+    def update(self, values, time):
+        """
+        Filter in the raw {key: value} readings taken at `time` seconds.
+        Missing keys or None values keep their current filtered state.
+        """
+        raw = np.array([values.get(key) for key in self.keys], dtype=np.float64)
+        present = np.isfinite(raw)
+
+        # The first reading of each key is taken as is
+        first = present & ~self._seen
+        self.value[first] = raw[first]
+        self._seen |= present
+
+        if self._time is not None and time > self._time:
+            dt = time - self._time
+            update = present & ~first
+            derivative = (raw[update] - self.value[update]) / dt
+            self.derivative[update] += _smoothing_factor(dt, self.derivative_cutoff[update]) * (derivative - self.derivative[update])
+            cutoff = self.min_cutoff[update] + self.beta[update] * np.abs(self.derivative[update])
+            self.value[update] += _smoothing_factor(dt, cutoff) * (raw[update] - self.value[update])
+        self._time = time
+
+    def output(self, time=None):
+        """ {key: value} of the filtered inputs, extrapolated to `time` if given. """
+        ahead = self.extrapolate
+        if time is not None and self._time is not None:
+            ahead = ahead + min(max(time - self._time, 0), MAX_EXTRAPOLATION)
+        return dict(zip(self.keys, (self.value + np.where(self.extrapolate > 0, ahead, 0) * self.derivative).tolist()))
@@ -6,26 +6,66 @@ uniform vec3 lightDir;
 uniform vec3 diffuse;
 uniform float ambientFactor;
 uniform bool antialias;
-uniform int distanceEstimatorFunction;
+#ifdef ATLAS
+// An atlas draws a grid of cells at once, each with its own parameters read
+// from its row of atlasParams by LoadCellParams, see atlas.py
+uniform sampler2D atlasParams;
+uniform vec2 atlasCells;
+uniform vec2 atlasCellSize;
+float iterationScale;
+float iterationOffsetX;
+float iterationOffsetY;
+float iterationOffsetZ;
+float iterations;
+float trapWidth;
+float angleA;
+float angleB;
+float angleC;
+float boundingRadius;
+#else
 uniform float iterationScale;
 uniform float iterationOffsetX;
 uniform float iterationOffsetY;
 uniform float iterationOffsetZ;
 uniform float iterations;
-uniform int trapFunction;
 uniform float trapWidth;
-uniform int colorTrapFunction;
 uniform float angleA;
 uniform float angleB;
 uniform float angleC;
-
+// Every surface is within this distance of the origin for the current
+// parameters, or 0 if there's no bound, see bounds.py
+uniform float boundingRadius;
+#endif
+uniform vec2 jitter;
+// Pixel position of this draw within the whole image when it's rendered in
+// tiles, resolution is then the whole image's size, see OffscreenRenderer
+uniform vec2 tileOffset;
+uniform float sampleRotation;
+
+// DISTANCE_ESTIMATOR, TRAP_FUNCTION and COLOR_TRAP_FUNCTION are defined by
+// FractalProgram for each compiled variant, see fractal.py. The quality
+// constants below can be overridden the same way, see quality.py.
 #define PI 3.14159265
 #define GAMMA 0.8
+
+#ifndef AO_SAMPLES
 #define AO_SAMPLES 5
+#endif
+#ifndef RAY_DEPTH
 #define RAY_DEPTH 256
+#endif
+#ifndef MAX_DEPTH
 #define MAX_DEPTH 100.0
+#endif
+#ifndef SHADOW_RAY_DEPTH
 #define SHADOW_RAY_DEPTH 32
+#endif
+#ifndef DISTANCE_MIN
 #define DISTANCE_MIN 0.01
+#endif
+#ifndef ANTIALIAS_SAMPLES
+#define ANTIALIAS_SAMPLES 4
+#endif
 
 const vec2 delta = vec2(DISTANCE_MIN, 0.);
 
@@ -64,24 +104,29 @@ vec2 rotate(vec2 v, float a) {
 }
 
 float trap(vec3 p){
-  switch (trapFunction) {
-    case 1: return length(p); // <- no trap
-    case 2: return length(p.x-(trapWidth)); // <- cube forms
-    case 3: return length(p.xz-vec2(trapWidth, trapWidth))-0.05; // <- tube forms
-  }
+#if TRAP_FUNCTION == 1
+  return length(p); // <- no trap
+#elif TRAP_FUNCTION == 2
+  return length(p.x-(trapWidth)); // <- cube forms
+#elif TRAP_FUNCTION == 3
+  return length(p.xz-vec2(trapWidth, trapWidth))-0.05; // <- tube forms
+#endif
   // return  length(p.x-1.0); // unit cube
   // return  length(p.x-0.5-0.5*sin(time/10.0)); // <- cube forms
 }
 
 vec3 colorTrap(vec3 previousTrap, float iterationFactor, vec3 p) {
-  switch (colorTrapFunction) {
-    case 1: return min(previousTrap, p * iterationFactor); // channel wise distance from the axis
-    case 2: return max(previousTrap, 1/p); // channel wise proximity to the axis
-    case 3: return min(previousTrap, normalize(p));
-    // case 4: return vec3(0.4, 0.2, 0.3);
-  }
+#if COLOR_TRAP_FUNCTION == 1
+  return min(previousTrap, p * iterationFactor); // channel wise distance from the axis
+#elif COLOR_TRAP_FUNCTION == 2
+  return max(previousTrap, 1/p); // channel wise proximity to the axis
+#elif COLOR_TRAP_FUNCTION == 3
+  return min(previousTrap, normalize(p));
+#endif
+  // return vec3(0.4, 0.2, 0.3);
 }
 
+#if DISTANCE_ESTIMATOR == 1
 // from https://www.shadertoy.com/view/XsX3z7
 float OctoKaleidoscopeIFS(in vec3 z, out vec3 trapDistance) {
   float pointDistance = 1000.0;
@@ -109,7 +154,9 @@ float OctoKaleidoscopeIFS(in vec3 z, out vec3 trapDistance) {
   }
   return pointDistance;
 }
+#endif
 
+#if DISTANCE_ESTIMATOR == 2
 float TetraKaleidoscopeIFS(in vec3 z, out vec3 trapDistance) {
   float pointDistance = 1000.0;
   trapDistance = vec3(1000.0, 1000.0, 1000.0);
@@ -131,7 +178,9 @@ float TetraKaleidoscopeIFS(in vec3 z, out vec3 trapDistance) {
   }
   return pointDistance;
 }
+#endif
 
+#if DISTANCE_ESTIMATOR == 3
 // angleA == fixedRadius2, angleB == minRadius2
 void sphereFold(inout vec3 z, inout float dz) {
 	float r2 = dot(z,z);
@@ -167,17 +216,20 @@ float Mandelbox(vec3 z, out vec3 trapDistance) {
 	float r = length(z);
 	return r/abs(dr);
 }
+#endif
 
 // This should return continuous positive values when outside and negative values inside,
 // which roughly indicate the distance of the nearest surface.
 float Dist(vec3 pos, out vec3 trapDistance) {
    pos = RotateY(pos, time*0.025);
 
-  switch(distanceEstimatorFunction) {
-    case 1: return OctoKaleidoscopeIFS(pos, trapDistance);
-    case 2: return TetraKaleidoscopeIFS(pos, trapDistance);
-    case 3: return Mandelbox(pos, trapDistance);
-  }
+#if DISTANCE_ESTIMATOR == 1
+  return OctoKaleidoscopeIFS(pos, trapDistance);
+#elif DISTANCE_ESTIMATOR == 2
+  return TetraKaleidoscopeIFS(pos, trapDistance);
+#elif DISTANCE_ESTIMATOR == 3
+  return Mandelbox(pos, trapDistance);
+#endif
 }
 
 // Based on original by IQ - optimized to remove a divide
@@ -246,8 +298,60 @@ vec3 GetRay(vec3 dir, vec2 pos) {
    return dir + right*pos.x + up*pos.y;
 }
 
-vec4 March(vec3 ro, vec3 rd, out vec3 trapDistance) {
-   float t = 0.0;
+// Position of this pixel in the image the rays are cast for
+vec2 PixelCoord() {
+#ifdef ATLAS
+  return mod(gl_FragCoord.xy, atlasCellSize);
+#else
+  return gl_FragCoord.xy + tileOffset;
+#endif
+}
+
+#ifdef ATLAS
+#if defined(ADAPTIVE_ANTIALIAS) || defined(TEMPORAL_REPROJECTION)
+#error ATLAS only works with the plain pipeline
+#endif
+void LoadCellParams() {
+  // Cells are numbered row by row from the top left, like the contact sheet
+  vec2 cell = floor(gl_FragCoord.xy / atlasCellSize);
+  float index = (atlasCells.y - 1.0 - cell.y) * atlasCells.x + cell.x;
+  float v = (index + 0.5) / (atlasCells.x * atlasCells.y);
+  vec4 a = texture2D(atlasParams, vec2(0.5 / 3.0, v));
+  vec4 b = texture2D(atlasParams, vec2(1.5 / 3.0, v));
+  vec4 c = texture2D(atlasParams, vec2(2.5 / 3.0, v));
+  iterationScale = a.x;
+  iterationOffsetX = a.y;
+  iterationOffsetY = a.z;
+  iterationOffsetZ = a.w;
+  iterations = b.x;
+  trapWidth = b.y;
+  angleA = b.z;
+  angleB = b.w;
+  angleC = c.x;
+  boundingRadius = c.y;
+}
+#endif
+
+// Clips [tStart, tEnd] along the normalized ray to the bounding sphere,
+// returns false if none of it is inside
+bool ClipToBounds(vec3 ro, vec3 rd, inout float tStart, inout float tEnd) {
+   if (boundingRadius <= 0.0) return true;
+   float b = dot(ro, rd);
+   float h = b*b - dot(ro, ro) + boundingRadius*boundingRadius;
+   if (h < 0.0) return false;
+   h = sqrt(h);
+   tStart = max(tStart, -b - h);
+   tEnd = min(tEnd, -b + h);
+   return tStart < tEnd;
+}
+
+// Marches from tStart along the ray, which must be known to be in front of any surface
+vec4 March(vec3 ro, vec3 rd, float tStart, out vec3 trapDistance) {
+   float t = tStart;
+   float tEnd = MAX_DEPTH;
+   trapDistance = vec3(1000.0);
+   if (!ClipToBounds(ro, rd, t, tEnd)) return vec4(0.0);
+
    float d = 1.0;
    for (int i=0; i<RAY_DEPTH; i++)
    {
@@ -258,31 +362,134 @@ vec4 March(vec3 ro, vec3 rd, out vec3 trapDistance) {
          return vec4(p, 1.0);
       }
       t += d;
-      if (t >= MAX_DEPTH) break;
+      if (t >= tEnd) break;
    }
    return vec4(0.0);
 }
 
- // https://www.shadertoy.com/view/lt fSWn
+#ifdef ADAPTIVE_ANTIALIAS
+// Adaptive antialiasing runs in two passes over the same program. The first
+// marches one ray per pixel and stores its shaded colour and hit depth into
+// firstPass. The second compares each pixel with its neighbours there, and
+// only marches the extra rotated-grid samples where it finds an edge.
+uniform bool edgePass;
+uniform sampler2D firstPass;
+uniform float edgeDepthThreshold;
+uniform float edgeColorThreshold;
+
+bool Differs(vec4 a, vec4 b) {
+  vec3 colorDifference = abs(a.rgb - b.rgb);
+  return abs(a.a - b.a) > edgeDepthThreshold * min(a.a, b.a) ||
+         max(colorDifference.r, max(colorDifference.g, colorDifference.b)) > edgeColorThreshold;
+}
+
+bool IsEdge(vec2 uv, vec4 center) {
+  vec2 texel = 1.0 / resolution;
+  return Differs(center, texture2D(firstPass, uv + vec2(texel.x, 0.0))) ||
+         Differs(center, texture2D(firstPass, uv - vec2(texel.x, 0.0))) ||
+         Differs(center, texture2D(firstPass, uv + vec2(0.0, texel.y))) ||
+         Differs(center, texture2D(firstPass, uv - vec2(0.0, texel.y)));
+}
 
 void main() {
-  const int ANTIALIAS_SAMPLES = 4;
+  vec3 ro = cameraPos;
+  vec3 trapDistance;
+
+  if (!edgePass) {
+    vec3 rd = normalize(GetRay(cameraLookat-cameraPos, (PixelCoord() + jitter) / resolution));
+    vec4 _res = March(ro, rd, 0.0, trapDistance);
+    if (_res.a == 1.0) {
+      vec3 color = clamp(Shading(_res.rgb, rd, GetNormal(_res.rgb), trapDistance).rgb, 0.0, 1.0);
+      gl_FragColor = vec4(color, length(_res.rgb - ro) / MAX_DEPTH);
+    } else {
+      gl_FragColor = vec4(0.0, 0.0, 0.0, 1.0);
+    }
+    return;
+  }
+
+  vec2 uv = gl_FragCoord.xy / resolution;
+  vec4 center = texture2D(firstPass, uv);
+  if (!IsEdge(uv, center)) {
+    gl_FragColor = vec4(center.rgb, 1.0);
+    return;
+  }
 
+  vec3 res = center.rgb;
+  float d_ang = 2.*PI / float(ANTIALIAS_SAMPLES);
+  float ang = d_ang * 0.33333 + sampleRotation;
+  float r = 0.3;
+
+  for (int i = 0; i < ANTIALIAS_SAMPLES; i++) {
+     vec2 p = (PixelCoord() + jitter + vec2(cos(ang), sin(ang)) * r) / resolution;
+     vec3 rd = normalize(GetRay(cameraLookat-cameraPos, p));
+     vec4 _res = March(ro, rd, 0.0, trapDistance);
+
+     if (_res.a == 1.0) {
+        float depth = length(_res.rgb - ro) / MAX_DEPTH;
+        if (abs(depth - center.a) < edgeDepthThreshold * center.a) {
+          // Same surface the first pass already shaded for this pixel
+          res += center.rgb;
+        } else {
+          res += clamp(Shading(_res.rgb, rd, GetNormal(_res.rgb), trapDistance).rgb, 0.0, 1.0);
+        }
+     }
+     ang += d_ang;
+  }
+
+  gl_FragColor = vec4(res / float(ANTIALIAS_SAMPLES + 1), 1.0);
+}
+
+#else
+#ifdef TEMPORAL_REPROJECTION
+// The camera never moves, so each pixel's rays are the same every frame and
+// the scene only drifts slowly. Rays start temporalMargin before where the
+// pixel hit last frame, kept in the alpha of previousDepth, unless that start
+// point turns out to be too close to the surface already.
+uniform sampler2D previousDepth;
+uniform bool temporalValid;
+uniform float temporalMargin;
+
+float StartDistance(vec3 ro, vec3 rd) {
+  if (!temporalValid) return 0.0;
+
+  float previous = texture2D(previousDepth, gl_FragCoord.xy / resolution).a * MAX_DEPTH;
+  if (previous >= MAX_DEPTH) return 0.0; // missed last frame, something may have moved in
+
+  float start = max(previous - temporalMargin, 0.0);
+  vec3 tmp;
+  if (Dist(ro + rd * start, tmp) < temporalMargin * 0.5) return 0.0; // surface came closer
+  return start;
+}
+#endif
+
+ // https://www.shadertoy.com/view/lt fSWn
+
+void main() {
+#ifdef ATLAS
+  LoadCellParams();
+#endif
   vec4 res = vec4(0.0);
+  float depth = MAX_DEPTH;
 
   float d_ang = 2.*PI / float(ANTIALIAS_SAMPLES);
-  float ang = d_ang * 0.33333;
+  float ang = d_ang * 0.33333 + sampleRotation;
   float r = 0.3;
 
   for (int i = 0; i < ANTIALIAS_SAMPLES; i++) {
-     vec2 p = vec2((gl_FragCoord.x + cos(ang)*r) / resolution.x, (gl_FragCoord.y + sin(ang)*r) / resolution.y);
+     vec2 fragCoord = PixelCoord() + jitter;
+     vec2 p = vec2((fragCoord.x + cos(ang)*r) / resolution.x, (fragCoord.y + sin(ang)*r) / resolution.y);
      vec3 ro = cameraPos;
      vec3 rd = normalize(GetRay(cameraLookat-cameraPos, p));
      vec3 trapDistance;
-     vec4 _res = March(ro, rd, trapDistance);
+#ifdef TEMPORAL_REPROJECTION
+     vec4 _res = March(ro, rd, StartDistance(ro, rd), trapDistance);
+#else
+     vec4 _res = March(ro, rd, 0.0, trapDistance);
+#endif
 
      if (_res.a == 1.0) {
         res.rgb += clamp(Shading(_res.rgb, rd, GetNormal(_res.rgb), trapDistance).rgb, 0.0, 1.0);
+        depth = min(depth, length(_res.rgb - ro));
      } else {
         res.rgb = vec3(0, 0, 0);
         // res.rgb = vec3(0.8, 0.95, 1.0) * (0.7 + 0.3 * rd.y);
@@ -293,5 +500,10 @@ void main() {
 
   res.rgb /= float(ANTIALIAS_SAMPLES);
 
+#ifdef TEMPORAL_REPROJECTION
+  gl_FragColor = vec4(res.rgb, depth / MAX_DEPTH);
+#else
   gl_FragColor = vec4(res.rgb, 1.0);
+#endif
 }
+#endif
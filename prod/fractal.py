@@ -1,21 +1,80 @@
 from vispy import gloo
 import numpy as np
+from bounds import bounding_radius
 from utils import normalize, read_shader
 import random
 
+COLOR_TRAP_FUNCTIONS = [1]
+
+FRACTAL_SHADERS = ('fractal.vert', 'fractal.frag')
+
+# Mapped parameters closer than this to their uploaded value aren't uploaded again
+ADJUST_EPSILON = 1e-6
+
+# fractal.frag's default, for programs whose quality doesn't define it
+DISTANCE_MIN = 0.01
+
+_shader_sources = {}
+
+
+def fractal_shaders(variant, **defines):
+    """
+    Vertex and fragment source for a (distance_estimator, trap_function,
+    color_trap_function) variant. The choices are compiled in as preprocessor
+    constants so the shader doesn't branch on them inside the march loop.
+    Sources are cached by variant and any extra defines.
+    """
+    key = (variant, tuple(sorted(defines.items())))
+    if key not in _shader_sources:
+        distance_estimator, trap_function, color_trap_function = variant
+        header = {
+            'DISTANCE_ESTIMATOR': distance_estimator,
+            'TRAP_FUNCTION': trap_function,
+            'COLOR_TRAP_FUNCTION': color_trap_function,
+        }
+        header.update(defines)
+        header = ''.join('#define %s %s\n' % (name, value) for name, value in sorted(header.items()))
+        vertex, fragment = FRACTAL_SHADERS
+        _shader_sources[key] = (read_shader(vertex), header + read_shader(fragment))
+    return _shader_sources[key]
+
+
+def reload_shaders():
+    """ Forget cached shader sources, so programs created after this read the files again. """
+    _shader_sources.clear()
+
+
+def definition_variants(definition):
+    return [(definition['distance_estimator'], trap_function, color_trap_function)
+            for trap_function in definition['trap_functions']
+            for color_trap_function in COLOR_TRAP_FUNCTIONS]
+
+
+def choose_variant(definition):
+    return (definition['distance_estimator'], random.choice(definition['trap_functions']), random.choice(COLOR_TRAP_FUNCTIONS))
+
 
 class FractalProgram(gloo.Program):
 
-    def __init__(self, definition, mask=False):
-        super(FractalProgram, self).__init__(read_shader('fractal.vert'), read_shader('fractal.frag'))
+    # Uniforms the render pipeline sets around the fractal (sample positions,
+    # passes, buffers from earlier frames) which don't change the scene
+    PIPELINE_UNIFORMS = ('jitter', 'sampleRotation', 'edgePass', 'firstPass', 'previousDepth', 'temporalValid', 'temporalMargin')
 
-        self.definition = definition
+    def __init__(self, definition, mask=False, variant=None, defines=None):
+        self.variant = variant or choose_variant(definition)
+        self.distance_min = float((defines or {}).get('DISTANCE_MIN', DISTANCE_MIN))
+        self.changed = True
+        self._values = {}
+        super(FractalProgram, self).__init__(*fractal_shaders(self.variant, **(defines or {})))
 
         # Fill screen with single quad, fragment shader does all the real work
         self["position"] = [(-1, -1), (-1, 1), (1, 1),
                             (-1, -1), (1, 1), (1, -1)]
 
         self['time'] = 0
+        self['jitter'] = (0, 0)
+        self['sampleRotation'] = 0
+        self['tileOffset'] = (0, 0)
 
         if mask:
             self['cameraPos'] = (0.0, 9.0, -12.0)
@@ -28,18 +87,58 @@ class FractalProgram(gloo.Program):
         self['diffuse'] = (1, 1, 1)
         self['ambientFactor'] = 0.45
         self['resolution'] = [10, 10]
-        self['distanceEstimatorFunction'] = self.definition['distance_estimator']
-        self['trapFunction'] = random.choice(self.definition['trap_functions'])
-        self['colorTrapFunction'] = random.choice([1])
+
+        self.use_definition(definition)
+
+    def __setitem__(self, name, value):
+        # Remember whether anything that affects the image was set to a new value since the last
+        # time `changed` was cleared, so static scenes can be detected
+        if name not in self.PIPELINE_UNIFORMS and not np.array_equal(self._values.get(name), value):
+            self.changed = True
+        self._values[name] = value
+        super(FractalProgram, self).__setitem__(name, value)
+
+    def use_definition(self, definition):
+        # Any definition sharing this program's variant can reuse the compiled program
+        if definition['distance_estimator'] != self.variant[0]:
+            raise ValueError("%s uses distance estimator %s, but this program was compiled for %s" % (
+                definition['name'], definition['distance_estimator'], self.variant[0]))
+        self.definition = definition
 
         for param, param_description in self.definition['params'].iteritems():
             self[param] = param_description['initial']
 
+        # Parameter ranges as arrays so adjust maps all of them at once
+        params = self.definition['params']
+        self._param_names = sorted(params)
+        self._param_min = np.array([params[name]['min'] for name in self._param_names], dtype=np.float64)
+        self._param_delta = np.array([params[name]['delta'] for name in self._param_names], dtype=np.float64)
+        self._param_uploaded = np.array([params[name]['initial'] for name in self._param_names], dtype=np.float64)
+        self.update_bounds()
+
     def adjust(self, adjustments):
-        for key, value in adjustments.iteritems():
-            param = self.definition['params'][key]['min'] + self.definition['params'][key]['delta'] * value
-            # print "Setting %s to %s, adjustment: %s, min: %s delta: %s" % (key, param, value, self.definition['params'][key]['min'], self.definition['params'][key]['delta'])
-            self[key] = param
+        """
+        Map normalized 0..1 adjustments onto the definition's parameter ranges,
+        and upload only the parameters that moved by more than ADJUST_EPSILON.
+        Returns True if any parameter was uploaded.
+        """
+        adjustment_values = np.array([adjustments.get(name, np.nan) for name in self._param_names], dtype=np.float64)
+        params = self._param_min + self._param_delta * adjustment_values
+        difference = np.abs(params - self._param_uploaded)
+        difference[np.isnan(difference)] = 0  # parameters without an adjustment
+        changed = difference > ADJUST_EPSILON
+
+        for index in np.flatnonzero(changed):
+            self[self._param_names[index]] = params[index]
+        self._param_uploaded[changed] = params[changed]
+        if changed.any():
+            self.update_bounds()
+        return bool(changed.any())
+
+    def update_bounds(self):
+        """ Re-derive the bounding sphere March clips rays to from the uploaded parameters, see bounds.py. """
+        params = dict(zip(self._param_names, self._param_uploaded))
+        self['boundingRadius'] = bounding_radius(self.variant[0], self.variant[1], params, self.distance_min) or 0.0
 
     def _initial_definition_value(value):
         if isinstance(value, dict):
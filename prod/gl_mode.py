@@ -0,0 +1,28 @@
+from vispy import gloo
+
+GL_MODES = ['debug', 'production']
+
+
+def use_gl_mode(mode):
+    """
+    'debug' wraps every GL call to log it and check for errors. 'production'
+    calls GL directly and leaves error checking to a `SampledErrorCheck`.
+    """
+    gloo.gl.use_gl('gl2 debug' if mode == 'debug' else 'gl2')
+
+
+class SampledErrorCheck(object):
+    """
+    Checks for GL errors on every `interval`th call, e.g. once every so many
+    frames. Errors raise the same RuntimeError as debug mode, but only say
+    which stretch of calls they happened in.
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.calls = 0
+
+    def __call__(self, when='periodic check'):
+        self.calls += 1
+        if self.calls % self.interval == 0:
+            gloo.gl.check_error('%s %d' % (when, self.calls))
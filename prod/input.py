@@ -1,12 +1,31 @@
-from primesense import _nite2, nite2, openni2
 import numpy as np
 import random
-from utils import joint_to_array, LowConfidenceException
+from sensor import SensorThread, JointType
+from skeleton_recording import ReplaySensor
+from features import JointFeatures
+from filters import FILTER_DEFAULTS, OneEuroFilter
 import yaml
 
-JT = _nite2.NiteJointType
+try:
+    from primesense import nite2, openni2
+except ImportError:
+    # Only recorded skeletons can be used without OpenNI/NiTE, see ReplayInput
+    nite2 = openni2 = None
 
-user_tracker = None
+JT = JointType
+
+INPUT_KEYS = ('angleA', 'angleB', 'angleC', 'iterationScale', 'iterationOffsetX', 'iterationOffsetY', 'iterationOffsetZ', 'trapWidth')
+
+# Shared by every skeleton input, since kiosk rotation creates new ones
+sensor = None
+# Segments the shared sensor's depth frames, see use_silhouettes
+segmenter = None
+
+
+def use_silhouettes(silhouette_segmenter):
+    """ Have the shared sensor segment silhouettes into its samples, before any skeleton input has started it. """
+    global segmenter
+    segmenter = silhouette_segmenter
 
 
 class Input(object):
@@ -18,6 +37,9 @@ class Input(object):
     def on_key_press(self, event):
         pass
 
+    def configure_filter(self, settings):
+        pass
+
     def inputs(self, elapsed):
         if self.time % 60 == 0:
             print self.smoothed_inputs
@@ -112,135 +134,107 @@ class FileStoredInput(FakeInput):
         return self.smoothed_inputs
 
 
-# MAX_DIFFERENCE = 0.05
-
-class SmoothInputs(dict):
-
-    def __init__(self, *args, **kwargs):
-        super(SmoothInputs, self).__init__(*args, **kwargs)
-        self._previous = {}
-
-    def smooth_update(self, attributes):
-        for key, value in attributes.iteritems():
-            self.smooth_set(key, value)
-
-    def smooth_set(self, key, value_func):
-        previous = self._previous.get(key, 0)
-        try:
-            value = value_func()
-        except LowConfidenceException:
-            value = previous
-            pass
+class FilteredInputs(dict):
+    """
+    The filtered value of each input, see `filters.OneEuroFilter`. Only new
+    readings update the filter, but the output is refreshed on every call
+    so it can be extrapolated to the current time.
+    """
 
-        # difference = value - previous
-        # if abs(difference) > MAX_DIFFERENCE:
-        #     print "key: %s, value: %s, previous: %s, difference: %s" % (key, value, previous, difference)
-        #     value = previous + np.sign(difference) * MAX_DIFFERENCE
+    def __init__(self, keys=INPUT_KEYS, **settings):
+        super(FilteredInputs, self).__init__()
+        self.filter = OneEuroFilter(keys, **settings)
+        self.update(self.filter.output())
 
-        self._previous[key] = self.get(key, 0)
-        self[key] = value
+    def filter_update(self, values, time, new=True):
+        if new:
+            self.filter.update(values, time)
+        self.update(self.filter.output(time))
 
 
 class SkeletonInput(Input):
 
-    def __init__(self):
+    # Input filter settings for this mapping, a definition's own settings take precedence
+    FILTER = {'extrapolate': 0.03}
+
+    def __init__(self, skeleton_sensor=None):
         super(SkeletonInput, self).__init__()
-        if user_tracker is None:
+        global sensor
+        if skeleton_sensor is None and sensor is None:
             openni2.initialize()
             nite2.initialize()
-
-        self.smoothed_inputs = SmoothInputs()
+            sensor = SensorThread(segmenter=segmenter)
+            sensor.start()
+
+        self.sensor = skeleton_sensor or sensor
+        self.sample = None
+        self.joint_features = JointFeatures()
+        self.smoothed_inputs = FilteredInputs(**self.FILTER)
+        self._filtered_index = None
         self.reset_user_tracker()
 
+    def configure_filter(self, settings):
+        self.smoothed_inputs.filter.configure(**FILTER_DEFAULTS)
+        self.smoothed_inputs.filter.configure(**self.FILTER)
+        self.smoothed_inputs.filter.configure(**settings)
+
     def reset_user_tracker(self):
-        global user_tracker
-        user_tracker = nite2.UserTracker(False)
-        user_tracker.skeleton_smoothing_factor = 0.8
+        self.sensor.reset()
+
+    def read_sample(self):
+        # The sensor thread keeps reading frames, this only picks up the newest one
+        self.sample = self.sensor.read(self.time)
+        if self.time % 60 == 0:
+            print self.sensor
+        return self.sample.users if self.sample is not None else []
 
     def inputs(self, elapsed):
         super(SkeletonInput, self).inputs(elapsed)
 
-        global user_tracker
-        frame = user_tracker.read_frame()
-        for user in frame.users:
-            if user.is_new():
-                user_tracker.start_skeleton_tracking(user.id)
-
-            if user.is_lost():
-                user_tracker.stop_skeleton_tracking(user.id)
-
-            print "%s: new: %s, visible: %s, lost: %s, skeleton state: %s" % (user.id, user.is_new(), user.is_visible(), user.is_lost(), user.skeleton.state)
-
-            if user.skeleton.state == _nite2.NiteSkeletonState.NITE_SKELETON_TRACKED and user.is_visible():
-                joints = user.skeleton.joints
-
-                try:
-                    user_height = self.joint_distance_in_space(joints[JT.NITE_JOINT_HEAD], joints[JT.NITE_JOINT_LEFT_FOOT])
-                except LowConfidenceException:
-                    user_height = 10000000
+        for user in self.read_sample():
+            if self.time % 30 == 0:
+                print "%s: new: %s, visible: %s, lost: %s, skeleton state: %s" % (user.id, user.new, user.visible, user.lost, user.skeleton_state)
 
+            if user.tracked:
+                features = self.joint_features(user.positions, user.confidences)
                 self.tracking_users = True
-                self.smoothed_inputs.smooth_update({
-                    'angleA': lambda: self.joint_line_angle_relative_to_plane(joints[JT.NITE_JOINT_LEFT_ELBOW], joints[JT.NITE_JOINT_RIGHT_ELBOW], np.array((0, 0, 1))),
-                    'angleB': lambda: self.joint_angle_relative_to_joint(joints[JT.NITE_JOINT_RIGHT_ELBOW], joints[JT.NITE_JOINT_RIGHT_SHOULDER], joints[JT.NITE_JOINT_RIGHT_HAND]),
-                    'angleC': lambda: self.joint_angle_relative_to_joint(joints[JT.NITE_JOINT_LEFT_ELBOW], joints[JT.NITE_JOINT_LEFT_SHOULDER], joints[JT.NITE_JOINT_LEFT_HAND]),
-                    'iterationScale': lambda: self.joint_angle_relative_to_joint(joints[JT.NITE_JOINT_LEFT_SHOULDER], joints[JT.NITE_JOINT_LEFT_HIP], joints[JT.NITE_JOINT_LEFT_ELBOW]),
-                    'iterationOffsetX': lambda: self.joint_angle_relative_to_joint(joints[JT.NITE_JOINT_RIGHT_SHOULDER], joints[JT.NITE_JOINT_RIGHT_HIP], joints[JT.NITE_JOINT_RIGHT_ELBOW]),
-                    'iterationOffsetY': lambda: self.joint_angle_relative_to_joint(joints[JT.NITE_JOINT_RIGHT_SHOULDER], joints[JT.NITE_JOINT_RIGHT_HIP], joints[JT.NITE_JOINT_RIGHT_ELBOW]),
-                    'iterationOffsetZ': lambda: self.joint_angle_relative_to_joint(joints[JT.NITE_JOINT_RIGHT_SHOULDER], joints[JT.NITE_JOINT_RIGHT_HIP], joints[JT.NITE_JOINT_RIGHT_ELBOW]),
-                    'trapWidth': lambda: self.joint_angle_relative_to_joint(joints[JT.NITE_JOINT_RIGHT_ELBOW], joints[JT.NITE_JOINT_RIGHT_SHOULDER], joints[JT.NITE_JOINT_RIGHT_HAND])
-                })
+                self.smoothed_inputs.filter_update(features, self.time, new=self.sample.index != self._filtered_index)
+                self._filtered_index = self.sample.index
 
                 return self.smoothed_inputs
 
         self.tracking_users = False
-        self.smoothed_inputs.smooth_update({
-            'angleA': lambda: 0.5 + np.sin(self.time / 8.0) / 2,
-            'angleB': lambda: 0.5 + np.sin(self.time / 7.0) / 2,
-            'angleC': lambda: 0.5 + np.sin(self.time / 11.0) / 2,
-            'iterationScale': lambda: 0.5 + np.sin(self.time / 6.0) / 2,
-            'iterationOffsetX': lambda: 0.5 + np.sin(self.time / 6.0) / 2,
-            'iterationOffsetY': lambda: 0.5 + np.sin(self.time / 6.0) / 2,
-            'iterationOffsetZ': lambda: 0.5 + np.sin(self.time / 8.0) / 2,
-            'trapWidth': lambda: 0.5 + np.sin(self.time / 5.0) / 2,
-        })
+        self._filtered_index = None
+        self.smoothed_inputs.filter_update({
+            'angleA': 0.5 + np.sin(self.time / 8.0) / 2,
+            'angleB': 0.5 + np.sin(self.time / 7.0) / 2,
+            'angleC': 0.5 + np.sin(self.time / 11.0) / 2,
+            'iterationScale': 0.5 + np.sin(self.time / 6.0) / 2,
+            'iterationOffsetX': 0.5 + np.sin(self.time / 6.0) / 2,
+            'iterationOffsetY': 0.5 + np.sin(self.time / 6.0) / 2,
+            'iterationOffsetZ': 0.5 + np.sin(self.time / 8.0) / 2,
+            'trapWidth': 0.5 + np.sin(self.time / 5.0) / 2,
+        }, self.time)
 
         return self.smoothed_inputs
 
-    def joint_distance_relative_to_reference_joint_distance(self, joint_a, joint_b, reference_joint_a, reference_joint_b, max_multiplier):
-        variable_distance = self.joint_distance_in_space(joint_a, joint_b)
-        reference_distance = self.joint_distance_in_space(reference_joint_a, reference_joint_b)
-
-        return np.clip((variable_distance / reference_distance) / max_multiplier, 0, 1)
-
-    def joint_angle_relative_to_joint(self, root, appendage_a, appendage_b):
-        # inverse of cosine law -- translate the vectors to the root by subtracting out the root, then using an inverted dot product forumla isolating for the angle
-        root = joint_to_array(root)
-        a = joint_to_array(appendage_a) - root
-        b = joint_to_array(appendage_b) - root
-        return np.arccos(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))) / np.pi
-
-    def joint_distance_in_space(self, joint_a, joint_b):
-        return np.linalg.norm(joint_to_array(joint_a) - joint_to_array(joint_b))
-
-    def normalized_joint_distance_in_space(self, joint_a, joint_b, expected_lower_bound, expected_upper_bound):
-        return np.clip((self.joint_distance_in_space(joint_a, joint_b) - expected_lower_bound) / expected_upper_bound, 0, 1)
-
-    def joint_line_angle_relative_to_plane(self, joint_a, joint_b, plane_normal):
-        # http://www.vitutor.com/geometry/distance/line_plane.html
-        line = joint_to_array(joint_b) - joint_to_array(joint_a)
-        return np.arcsin(np.dot(line, plane_normal) / (np.linalg.norm(line) * np.linalg.norm(plane_normal))) / np.pi
-
-    def joint_angle_relative_to_screen(self, joint):
-        pass
-
     def on_key_press(self, event):
         if event.text == ' ':
             self.reset_user_tracker()
 
 
+class ReplayInput(SkeletonInput):
+    """ A `SkeletonInput` driven by a recording from skeleton_recording.py instead of the sensor. """
+
+    def __init__(self, path, realtime=True, loop=True):
+        super(ReplayInput, self).__init__(skeleton_sensor=ReplaySensor(path, realtime=realtime, loop=loop))
+
+
 class GroupBodyInputTracker(SkeletonInput):
 
+    # Centres of mass wobble as people shift their weight, smooth them more
+    FILTER = {'min_cutoff': 0.5, 'beta': 0.5}
+
     def __init__(self, *args, **kwargs):
         super(GroupBodyInputTracker, self).__init__(*args, **kwargs)
         self.min = 700
@@ -249,19 +243,20 @@ class GroupBodyInputTracker(SkeletonInput):
     def inputs(self, elapsed):
         Input.inputs(self, elapsed)
 
-        global user_tracker
-        frame = user_tracker.read_frame()
         positions = []
 
-        for user in frame.users:
+        for user in self.read_sample():
             if self.time % 30 == 0:
-                print "%s: new: %s, visible: %s, lost: %s" % (user.id, user.is_new(), user.is_visible(), user.is_lost())
+                print "%s: new: %s, visible: %s, lost: %s" % (user.id, user.new, user.visible, user.lost)
 
-            if user.is_visible():
-                positions.append(user.centerOfMass.z)
+            if user.visible:
+                positions.append(user.center_of_mass[2])
 
         if len(positions) > 0:
             self.tracking_users = True
+            # Render frames between sensor samples only read the filter, as in SkeletonInput
+            new = self.sample.index != self._filtered_index
+            self._filtered_index = self.sample.index
             self.min = min(self.min, min(positions))
             self.max = max(self.max, max(positions))
             position_range = float(self.max - self.min)
@@ -269,18 +264,20 @@ class GroupBodyInputTracker(SkeletonInput):
             normalized_positions = {i: np.clip(value, 0, 1) for i, value in enumerate(map(lambda p: (p - self.min) / position_range, positions))}
         else:
             self.tracking_users = False
+            self._filtered_index = None
+            new = True
             normalized_positions = {}
 
-        self.smoothed_inputs.smooth_update({
-            'angleA': lambda: normalized_positions.get(1, np.sin((self.time + 3) / 7.0) / 2),
-            'angleB': lambda: normalized_positions.get(0, np.sin((self.time + 3) / 9.0) / 2),
-            'angleC': lambda: normalized_positions.get(3, 0.5 + np.sin(self.time / 5.0) / 2),
-            'iterationScale': lambda: normalized_positions.get(2, 0.7 + np.sin((self.time + 3) / 9.0) / 3.3),
-            'iterationOffsetX': lambda: normalized_positions.get(0, 0.5 + np.sin(self.time / 6.0) / 2),
-            'iterationOffsetY': lambda: normalized_positions.get(0, 0.5 + np.sin(self.time / 6.0) / 2),
-            'iterationOffsetZ': lambda: normalized_positions.get(0, 0.5 + np.sin(self.time / 6.0) / 2),
-            'trapWidth': lambda: 0.5 + np.sin(self.time / 8.0) / 2,
-        })
+        self.smoothed_inputs.filter_update({
+            'angleA': normalized_positions.get(1, np.sin((self.time + 3) / 7.0) / 2),
+            'angleB': normalized_positions.get(0, np.sin((self.time + 3) / 9.0) / 2),
+            'angleC': normalized_positions.get(3, 0.5 + np.sin(self.time / 5.0) / 2),
+            'iterationScale': normalized_positions.get(2, 0.7 + np.sin((self.time + 3) / 9.0) / 3.3),
+            'iterationOffsetX': normalized_positions.get(0, 0.5 + np.sin(self.time / 6.0) / 2),
+            'iterationOffsetY': normalized_positions.get(0, 0.5 + np.sin(self.time / 6.0) / 2),
+            'iterationOffsetZ': normalized_positions.get(0, 0.5 + np.sin(self.time / 6.0) / 2),
+            'trapWidth': 0.5 + np.sin(self.time / 8.0) / 2,
+        }, self.time, new=new)
 
         return self.smoothed_inputs
 
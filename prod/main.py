@@ -1,11 +1,23 @@
 from vispy import app, gloo, set_log_level
 import time
 import random
-from fractal import FractalProgram
+from program_pool import FractalProgramPool
 from skeleton_bones import SkeletonBonesProgram
 from mask import MaskProgram
-from input import SkeletonInput, MicrosoftSkeletonInput, FakeInput, GroupBodyInputTracker
-from definitions import Definitions
+from blit import BlitProgram
+from resolution import ResolutionController, RenderTarget
+from accumulation import ProgressiveAccumulator
+from antialias import AdaptiveAntialiaser
+from temporal import TemporalReprojector
+from quality import QUALITY_PRESETS, DEFAULT_QUALITY, calibrate, pick_qualities
+from profiler import FrameProfiler
+from gl_mode import GL_MODES, use_gl_mode, SampledErrorCheck
+from input import SkeletonInput, MicrosoftSkeletonInput, FakeInput, GroupBodyInputTracker, ReplayInput, use_silhouettes
+from silhouette import SilhouetteSegmenter
+from definitions import Definitions, DefinitionError, DEFINITIONS_PATH, reload_definitions
+from fractal import FRACTAL_SHADERS
+from utils import shader_path
+from watcher import FileWatcher
 
 
 KIOSK_INPUTS = [SkeletonInput, GroupBodyInputTracker]
@@ -15,19 +27,91 @@ class MainCanvas(app.Canvas):
 
     def __init__(self, *args, **kwargs):
         self.fake_inputs = kwargs.pop('fake_inputs', False)
+        self.replay_path = kwargs.pop('replay_path', None)
         self.draw_bones = kwargs.pop('draw_bones', False)
         self.kiosk_interval = kwargs.pop('kiosk_interval', 0)
         self.start_definition = kwargs.pop('start_definition', 0)
         self.start_input = kwargs.pop('start_input', 0)
         self.show_mask = kwargs.pop('mask', False)
+        self.silhouette = kwargs.pop('silhouette', False)
+        self.lazy_compile = kwargs.pop('lazy_compile', False)
+        self.target_frame_time = kwargs.pop('target_frame_time', 0)
+        self.min_scale = kwargs.pop('min_scale', 0.25)
+        self.max_scale = kwargs.pop('max_scale', 1.0)
+        self.sharpness = kwargs.pop('sharpness', 0.0)
+        self.antialias_samples = kwargs.pop('antialias_samples', None)
+        self.quality = kwargs.pop('quality', DEFAULT_QUALITY)
+        self.quality_budget = kwargs.pop('quality_budget', 1.0 / 30)
+        self.profile_path = kwargs.pop('profile_path', None)
+        self.gl_check_interval = kwargs.pop('gl_check_interval', 0)
+        self.progressive_passes = kwargs.pop('progressive_passes', 0)
+        self.adaptive_antialias = kwargs.pop('adaptive_antialias', False)
+        self.temporal = kwargs.pop('temporal', False)
+        self.watch = kwargs.pop('watch', False)
         super(MainCanvas, self).__init__(*args, **kwargs)
         gloo.set_state(clear_color='black', blend=True, blend_func=('src_alpha', 'one_minus_src_alpha'))
 
+        self.profiler = FrameProfiler(enabled=self.profile_path is not None)
+        self.gl_error_check = SampledErrorCheck(self.gl_check_interval) if self.gl_check_interval > 0 else None
+
         self.skeleton_bones = SkeletonBonesProgram()
-        self.mask = MaskProgram()
+        # Silhouettes come from the live sensor's depth frames, so fake and replayed inputs keep the triangle
+        if self.silhouette and (self.fake_inputs or self.replay_path):
+            print "Silhouettes need the live sensor, masking with the triangle instead"
+            self.silhouette = False
+        if self.silhouette:
+            use_silhouettes(SilhouetteSegmenter())
+        self.mask = MaskProgram(silhouette=self.silhouette)
+        self._silhouette_index = None
+
+        # With a target frame time the fractal renders offscreen at a scale
+        # picked per frame, and is then upscaled to the window
+        if self.target_frame_time > 0:
+            self.resolution_controller = ResolutionController(self.target_frame_time, self.min_scale, self.max_scale)
+            self.render_target = RenderTarget()
+            self.blit = BlitProgram(self.render_target.texture, sharpness=self.sharpness)
+        else:
+            self.resolution_controller = None
+
+        # Progressive mode keeps adding jittered passes while the scene is
+        # static, e.g. while paused, instead of redrawing identical frames
+        if self.progressive_passes > 0:
+            self.accumulator = ProgressiveAccumulator(max_passes=self.progressive_passes)
+        else:
+            self.accumulator = None
+        self.paused_at = None
+        self.dirty = True
+
+        # An explicit sample count overrides the quality tier's
+        defines = {}
+        if self.antialias_samples:
+            defines['ANTIALIAS_SAMPLES'] = self.antialias_samples
+        if self.adaptive_antialias:
+            self.antialiaser = AdaptiveAntialiaser()
+            defines['ADAPTIVE_ANTIALIAS'] = 1
+        else:
+            self.antialiaser = None
+        if self.temporal:
+            self.reprojector = TemporalReprojector()
+            defines['TEMPORAL_REPROJECTION'] = 1
+        else:
+            self.reprojector = None
 
         self.inputs = None
         self.input_manager = None
+        self.elapsed = 0
+        if self.quality == 'auto':
+            self.fractals = FractalProgramPool(Definitions.values(), mask=self.show_mask, defines=defines)
+            self.calibrate_quality()
+        else:
+            self.fractals = FractalProgramPool(Definitions.values(), mask=self.show_mask, defines=defines, quality=self.quality)
+        self.compile_timer = app.Timer(0.1, connect=self.compile_next, start=self.lazy_compile)
+        # A reloaded definition waiting for compile_next to compile its new estimator
+        self.pending_definition = None
+        self.fractal = None
+        if not self.lazy_compile:
+            self.fractals.warm_up()
+            self.fractals.report()
 
         self._starttime = time.time()
 
@@ -37,21 +121,31 @@ class MainCanvas(app.Canvas):
         if self.kiosk_interval > 0:
             self.kiosk_timer = app.Timer(self.kiosk_interval, connect=self.rotate, start=True)
 
-        self._timer = app.Timer('auto', connect=self.update, start=True)
+        # Edits to the definitions and shaders are picked up while running, see check_reload
+        if self.watch:
+            self.watcher = FileWatcher([DEFINITIONS_PATH] + [shader_path(name) for name in FRACTAL_SHADERS])
+            self.watch_timer = app.Timer(1.0, connect=self.check_reload, start=True)
+
+        self._timer = app.Timer('auto', connect=self.on_timer, start=True)
         self.show()
 
     def rotate(self, event=None):
         definition = Definitions[Definitions.keys()[self.definition_position % len(Definitions.keys())]]
-        self.fractal = FractalProgram(definition, mask=self.show_mask)
-
-        if self.inputs:
-            self.fractal.adjust(self.inputs)
-        self.apply_zoom()
+        self.pending_definition = None
+        try:
+            self.use_fractal(self.fractals.get(definition))
+        except RuntimeError as e:
+            if self.fractal is None:
+                raise
+            print "Keeping %s running, %s" % (self.fractal.definition['name'], e)
+            definition = self.fractal.definition
 
         # Only rotate the user tracker if there aren't users actively interacting
         if (not self.input_manager) or not self.input_manager.tracking_users:
             if self.fake_inputs:
                 self.input_manager = FakeInput()
+            elif self.replay_path:
+                self.input_manager = ReplayInput(self.replay_path)
             else:
                 input_manager_index = (self.input_position / 2) % len(KIOSK_INPUTS) # random.choice(range(len(KIOSK_INPUTS)))
                 self.input_manager = KIOSK_INPUTS[input_manager_index]()
@@ -59,27 +153,162 @@ class MainCanvas(app.Canvas):
 
             print "Rotated to %s feeding %s" % (self.input_manager, definition['name'])
 
+        self.input_manager.configure_filter(definition['filter'])
+
         self.definition_position += 1
         self.input_position += 1
 
+    def use_fractal(self, fractal):
+        self.fractal = fractal
+        if self.inputs:
+            self.fractal.adjust(self.inputs)
+        self.apply_zoom()
+        self.dirty = True
+
+    def check_reload(self, event=None):
+        changed = self.watcher.changed()
+        if DEFINITIONS_PATH in changed:
+            try:
+                reload_definitions()
+            except DefinitionError as e:
+                print "Keeping the running definitions, %s" % e
+            else:
+                print "Reloaded %d definitions" % len(Definitions)
+                self.fractals.queue(Definitions.values())
+                self.compile_timer.start()
+
+                # Switch the running fractal over to its new definition, or once compile_next
+                # has compiled it, a program for its new estimator
+                definition = Definitions.get(self.fractal.definition['name'])
+                if definition is not None:
+                    if definition['distance_estimator'] == self.fractal.variant[0] and self.fractal.variant[1] in definition['trap_functions']:
+                        self.fractal.use_definition(definition)
+                        self.use_fractal(self.fractal)
+                        self.input_manager.configure_filter(definition['filter'])
+                    else:
+                        self.pending_definition = definition
+
+        if any(shader_path(name) in changed for name in FRACTAL_SHADERS):
+            print "Shaders changed, recompiling %d fractal programs" % len(self.fractals.programs)
+            self.fractals.reload()
+            self.compile_timer.start()
+
+    def calibrate_quality(self):
+        # Time every definition at every quality tier at the size the fractal will be
+        # rendered at, then run each at the highest tier that fits in the frame budget
+        width, height = self.physical_size
+        if self.resolution_controller is not None:
+            width, height = int(width * self.max_scale), int(height * self.max_scale)
+
+        def render(fractal, size):
+            self.fractal = fractal
+            self.render_fractal(size)
+
+        timings = calibrate(self.fractals, Definitions.values(), (max(1, width), max(1, height)), render=render)
+        self.fractals.quality = pick_qualities(timings, Definitions.values(), self.quality_budget)
+        self.fractals.prune(Definitions.values())
+        for name, quality in sorted(self.fractals.quality.items()):
+            print "Using %s quality for %s" % (quality, name)
+
+    def compile_next(self, event=None):
+        # Compile one program per tick so idle time between frames warms the pool
+        more = self.fractals.warm_next()
+
+        # Reloaded programs replace the running one between frames
+        if self.pending_definition is not None:
+            fractal = self.fractals.compiled(self.pending_definition)
+            if fractal is not None:
+                self.input_manager.configure_filter(self.pending_definition['filter'])
+                self.pending_definition = None
+        else:
+            fractal = self.fractals.replacement(self.fractal)
+        if fractal is not None and fractal is not self.fractal:
+            self.use_fractal(fractal)
+
+        if not more:
+            self.compile_timer.stop()
+            self.fractals.report()
 
     def on_draw(self, event):
-        elapsed = time.time() - self._starttime
+        if self.gl_error_check is not None:
+            # Catches errors from the previous frame, whose GL commands ran after on_draw returned
+            self.gl_error_check('frame')
+
+        elapsed = (self.paused_at or time.time()) - self._starttime
+        self.elapsed = elapsed
         self.input_manager.time = elapsed
         self.fractal['time'] = elapsed
-        self.fractal.draw()
+        with self.profiler.stage('fractal'):
+            self.draw_fractal()
 
-        self.inputs = self.input_manager.inputs(elapsed)
-        self.fractal.adjust(self.inputs)
+        with self.profiler.stage('inputs'):
+            if self.paused_at is None or self.inputs is None:
+                self.inputs = self.input_manager.inputs(elapsed)
+        with self.profiler.stage('adjust'):
+            self.dirty = self.fractal.adjust(self.inputs)
 
-        if not self.fake_inputs and self.draw_bones and hasattr(self.input_manager, 'user_tracker'):
-            self.skeleton_bones.draw(self.input_manager.user_tracker.read_frame())
+        if not self.fake_inputs and self.draw_bones and getattr(self.input_manager, 'sample', None) is not None:
+            with self.profiler.stage('bones'):
+                self.skeleton_bones.draw(self.input_manager.sample)
 
         if self.show_mask:
-            self.mask.draw()
+            with self.profiler.stage('mask'):
+                sample = getattr(self.input_manager, 'sample', None)
+                if self.silhouette and sample is not None and sample.silhouette is not None and sample.index != self._silhouette_index:
+                    self._silhouette_index = sample.index
+                    self.mask.set_silhouette(sample.silhouette)
+                self.mask.draw()
+
+        self.profiler.end_frame()
+
+    def draw_fractal(self):
+        if self.accumulator is not None:
+            size = self.physical_size
+            self.accumulator.draw(self.fractal, size, render=lambda: self.render_fractal(size))
+            return
+
+        if self.resolution_controller is None:
+            self.render_fractal(self.physical_size)
+            return
+
+        scale = self.resolution_controller.update()
+        width, height = self.physical_size
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if self.render_target.resize(size):
+            self.blit.set_source(self.render_target.texture)
+        self.fractal['resolution'] = size
+
+        with self.render_target.framebuffer:
+            gloo.set_viewport(0, 0, *size)
+            self.render_fractal(size)
+
+        # Everything after the fractal draws at native resolution
+        gloo.set_viewport(0, 0, width, height)
+        self.blit.draw()
+
+    def render_fractal(self, size):
+        # Draws the fractal at size into whichever framebuffer is bound
+        if self.antialiaser is not None:
+            self.antialiaser.draw(self.fractal, size)
+        elif self.reprojector is not None:
+            self.reprojector.draw(self.fractal, size, self.inputs, self.elapsed)
+        else:
+            self.fractal.draw()
+
+    def on_timer(self, event):
+        # While paused nothing moves, so frames are only drawn until the parameters settle
+        # and progressive passes converge, instead of redrawing the same image
+        if self.paused_at is None or self.dirty or (self.accumulator is not None and not self.accumulator.converged):
+            self.update()
 
     def on_resize(self, event):
         self.apply_zoom()
+        self.dirty = True
+
+    def on_close(self, event):
+        if self.profiler.enabled:
+            print self.profiler.summary()
+            self.profiler.dump(self.profile_path)
 
     def apply_zoom(self):
         width, height = self.physical_size
@@ -90,7 +319,19 @@ class MainCanvas(app.Canvas):
         self.mask['resolution'] = [width, height]
 
     def on_key_press(self, event):
-        self.input_manager.on_key_press(event)
+        if event.text == 'p':
+            self.toggle_pause()
+        else:
+            self.input_manager.on_key_press(event)
+        self.dirty = True
+
+    def toggle_pause(self):
+        # Freezes time and inputs, so progressive mode can converge on the current frame
+        if self.paused_at is None:
+            self.paused_at = time.time()
+        else:
+            self._starttime += time.time() - self.paused_at
+            self.paused_at = None
 
 
 if __name__ == '__main__':
@@ -103,22 +344,57 @@ if __name__ == '__main__':
     parser.add_option("-i", "--start-input", type="int", default=0)
     parser.add_option("-s", "--fullscreen", default=False)
     parser.add_option("-f", "--fake", action="store_true")
+    parser.add_option("-r", "--replay", type="string", metavar="PATH")
     parser.add_option("-b", "--bones", action="store_true")
     parser.add_option("-m", "--mask", action="store_true")
+    parser.add_option("--silhouette", action="store_true")
+    parser.add_option("-l", "--lazy-compile", action="store_true")
+    parser.add_option("-t", "--target-fps", type="float", default=0)
+    parser.add_option("--min-scale", type="float", default=0.25)
+    parser.add_option("--max-scale", type="float", default=1.0)
+    parser.add_option("--sharpness", type="float", default=0.0)
+    parser.add_option("-a", "--antialias-samples", type="int")
+    parser.add_option("-q", "--quality", type="choice", choices=QUALITY_PRESETS.keys() + ['auto'], default=DEFAULT_QUALITY)
+    parser.add_option("--budget-fps", type="float", default=30)
+    parser.add_option("--profile", type="string", metavar="PATH")
+    parser.add_option("--gl-mode", type="choice", choices=GL_MODES, default="debug")
+    parser.add_option("--gl-check-interval", type="int", default=60)
+    parser.add_option("-p", "--progressive", type="int", default=0)
+    parser.add_option("--adaptive-aa", action="store_true")
+    parser.add_option("--temporal", action="store_true")
+    parser.add_option("-w", "--watch", action="store_true")
 
     (options, args) = parser.parse_args()
+    if options.adaptive_aa and options.temporal:
+        parser.error("--adaptive-aa and --temporal can't be combined")
     set_log_level('INFO')
-    gloo.gl.use_gl('gl2 debug')
+    use_gl_mode(options.gl_mode)
     fullscreen = int(options.fullscreen) if options.fullscreen else False
 
     canvas = MainCanvas(size=(options.width, options.height),
                         keys='interactive',
                         resizable=True,
                         fake_inputs=options.fake,
+                        replay_path=options.replay,
                         draw_bones=options.bones,
                         fullscreen=fullscreen,
                         kiosk_interval=options.kiosk,
                         start_definition=options.start_definition,
-                        mask=options.mask,
+                        mask=options.mask or options.silhouette,
+                        silhouette=options.silhouette,
+                        lazy_compile=options.lazy_compile,
+                        target_frame_time=1.0 / options.target_fps if options.target_fps else 0,
+                        min_scale=options.min_scale,
+                        max_scale=options.max_scale,
+                        sharpness=options.sharpness,
+                        antialias_samples=options.antialias_samples,
+                        quality=options.quality,
+                        quality_budget=1.0 / options.budget_fps,
+                        profile_path=options.profile,
+                        gl_check_interval=options.gl_check_interval if options.gl_mode == 'production' else 0,
+                        progressive_passes=options.progressive,
+                        adaptive_antialias=options.adaptive_aa,
+                        temporal=options.temporal,
+                        watch=options.watch,
                         start_input=options.start_input)
     app.run()
@@ -5,6 +5,8 @@ uniform vec2 resolution;
 uniform vec4 foregroundColor;
 uniform vec4 backgroundColor;
 uniform float tipColorSelector;
+uniform bool useSilhouette;
+uniform sampler2D silhouette;
 
 
 vec3 hsv2rgb(vec3 c)
@@ -28,6 +30,14 @@ bool PointInTriangle (vec2 pt) {
 }
 
 void main() {
+  if (useSilhouette) {
+    // Silhouettes are uploaded as 0 or 1 bytes with rows top first, and blend at their edges
+    vec2 p = vec2(gl_FragCoord.x / resolution.x, 1.0 - gl_FragCoord.y / resolution.y);
+    float inside = clamp(texture2D(silhouette, p).r * 255.0, 0.0, 1.0);
+    gl_FragColor = mix(backgroundColor, foregroundColor, inside);
+    return;
+  }
+
   if (PointInTriangle(vec2(gl_FragCoord.x / resolution.x, gl_FragCoord.y / resolution.y))) {
     if ((gl_FragCoord.y / resolution.y) < (triangleC.y + 0.02)) {
       gl_FragColor = vec4(hsv2rgb(vec3(tipColorSelector, 0.8, 0.4)), 1.0);                                   
@@ -1,11 +1,18 @@
 from vispy import gloo
 import numpy as np
+from depth import DEPTH_SHAPE
 from utils import read_shader
 
 
 class MaskProgram(gloo.Program):
+    """
+    Covers everything outside the mask with `bg` and inside it with `fg`.
+    The mask is the calibrated triangle, or with `silhouette` the visitors'
+    silhouettes from a SilhouetteSegmenter, set each frame with
+    `set_silhouette`.
+    """
 
-    def __init__(self, fg=(1,1,1,0), bg=(0,0,0,1)):
+    def __init__(self, fg=(1,1,1,0), bg=(0,0,0,1), silhouette=False, silhouette_shape=(DEPTH_SHAPE[0] // 2, DEPTH_SHAPE[1] // 2)):
         super(MaskProgram, self).__init__(read_shader('mask.vert'), read_shader('mask.frag'))
 
         self["tipColorSelector"] = 0
@@ -18,3 +25,13 @@ class MaskProgram(gloo.Program):
         self["triangleA"] = (0.00, 1.0)
         self["triangleB"] = (1.0, 1.0)
         self["triangleC"] = (0.51, 0.00)
+
+        self["useSilhouette"] = silhouette
+        self.silhouette = gloo.Texture2D(shape=silhouette_shape + (1,), format='luminance', interpolation='linear')
+        self["silhouette"] = self.silhouette
+
+    def set_silhouette(self, silhouette):
+        """ Upload a bool silhouette, rows top first like depth frames. """
+        if silhouette.shape != self.silhouette.shape[:2]:
+            self.silhouette.resize(silhouette.shape + (1,))
+        self.silhouette.set_data(silhouette.view(np.uint8)[..., np.newaxis], offset=(0, 0))
@@ -0,0 +1,119 @@
+from vispy import app, gloo
+import numpy as np
+from program_pool import FractalProgramPool
+from accumulation import ProgressiveAccumulator
+from quality import DEFAULT_QUALITY
+from png_writer import PNGWriter
+
+
+class OffscreenRenderer(object):
+    """
+    Renders fractals into a framebuffer on a hidden canvas, so stills can be
+    produced without a window or any timers. The GL context, framebuffer and
+    a pool of compiled fractal programs are kept around between renders.
+    """
+
+    def __init__(self, backend='osmesa', quality=DEFAULT_QUALITY):
+        self.canvas = app.Canvas(app=backend, size=(1, 1), show=False)
+        self.canvas.set_current()
+        gloo.set_state(clear_color='black', blend=True, blend_func=('src_alpha', 'one_minus_src_alpha'))
+
+        self.framebuffer = gloo.FrameBuffer(color=gloo.RenderBuffer((1, 1)))
+        self.fractals = FractalProgramPool([], mask=False, quality=quality)
+        self.accumulator = None
+
+    def _fractal(self, definition, inputs, time, size, variant=None):
+        fractal = self.fractals.get(definition, variant=variant)
+        fractal['time'] = time
+        fractal['resolution'] = list(size)
+        fractal['tileOffset'] = (0, 0)
+        fractal.adjust(inputs)
+        return fractal
+
+    def render_still(self, definition, inputs, time, size, passes=1, variant=None):
+        width, height = size
+        if self.framebuffer.shape != (height, width):
+            self.framebuffer.resize((height, width))
+
+        fractal = self._fractal(definition, inputs, time, size, variant)
+        self.canvas.set_current()
+        return self._render(fractal, size, passes)
+
+    def render_tiled(self, definition, inputs, time, size, path, tile_size=512, passes=1, variant=None):
+        """
+        Render a still too large for one draw to a PNG at `path`, in tiles of
+        at most `tile_size` pixels square. Each tile is drawn into the same
+        framebuffer with its offset in the whole image, so the rays match a
+        single draw, and each row of tiles is written out before the next is
+        drawn. Only the plain and progressive pipelines can be tiled.
+        """
+        width, height = size
+        if self.framebuffer.shape != (tile_size, tile_size):
+            self.framebuffer.resize((tile_size, tile_size))
+
+        fractal = self._fractal(definition, inputs, time, size, variant)
+        self.canvas.set_current()
+        writer = PNGWriter(path, width, height)
+        try:
+            for top in range(0, height, tile_size):
+                band_height = min(tile_size, height - top)
+                band = np.empty((band_height, width, 4), dtype=np.uint8)
+                for left in range(0, width, tile_size):
+                    tile_width = min(tile_size, width - left)
+                    # GL counts rows up from the bottom of the image
+                    fractal['tileOffset'] = (left, height - top - band_height)
+                    tile = self._render(fractal, (tile_width, band_height), passes)
+                    band[:, left:left + tile_width] = tile[tile_size - band_height:, :tile_width]
+                writer.write_rows(band)
+                print "Rendered rows %d-%d of %d" % (top, top + band_height, height)
+        except Exception:
+            writer.abort()
+            raise
+        finally:
+            fractal['tileOffset'] = (0, 0)
+        writer.close()
+
+    def _render(self, fractal, size, passes):
+        # Draws into the bottom left `size` of the framebuffer and reads all of it back
+        width, height = size
+        if passes > 1:
+            if self.accumulator is None:
+                self.accumulator = ProgressiveAccumulator()
+            self.accumulator.max_passes = passes
+            self.accumulator.reset()
+            while not self.accumulator.converged:
+                self.accumulator.accumulate(fractal, size)
+
+        with self.framebuffer:
+            gloo.set_viewport(0, 0, width, height)
+            gloo.clear()
+            if passes > 1:
+                self.accumulator.resolve()
+            else:
+                fractal.draw()
+            return self.framebuffer.read()
+
+
+_renderer = None
+
+
+def _get_renderer(backend, quality):
+    # The offscreen context is created on the first render and reused afterwards
+    global _renderer
+    if _renderer is None:
+        _renderer = OffscreenRenderer(backend)
+    _renderer.fractals.quality = quality
+    return _renderer
+
+
+def render_still(definition, inputs, time, size, backend='osmesa', passes=1, quality=DEFAULT_QUALITY, variant=None):
+    """
+    Render one frame of `definition` at `size` (width, height) and return it
+    as an (height, width, 4) uint8 array, averaging `passes` jittered passes.
+    """
+    return _get_renderer(backend, quality).render_still(definition, inputs, time, size, passes=passes, variant=variant)
+
+
+def render_tiled(definition, inputs, time, size, path, tile_size=512, backend='osmesa', passes=1, quality=DEFAULT_QUALITY, variant=None):
+    """ Like `render_still`, but drawn in tiles and streamed to a PNG at `path`, see `OffscreenRenderer.render_tiled`. """
+    _get_renderer(backend, quality).render_tiled(definition, inputs, time, size, path, tile_size=tile_size, passes=passes, variant=variant)
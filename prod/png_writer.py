@@ -0,0 +1,81 @@
+import numpy as np
+import os
+import struct
+import zlib
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# Compressed data is written out in IDAT chunks of about this many bytes
+CHUNK_SIZE = 1 << 20
+
+
+class PNGWriter(object):
+    """
+    Streams an 8 bit RGBA or RGB image to a PNG file rows at a time, so
+    images far larger than memory can be written in bands. Rows go through
+    one zlib stream with no filtering. The image is written to `path`.part
+    and only renamed to `path` by `close` once all `height` rows were
+    written, so a failed render never leaves a truncated PNG behind.
+    """
+
+    def __init__(self, path, width, height, channels=4, compression=6):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows = 0
+        self.path = path
+        self.file = open(path + '.part', 'wb')
+        self.compressor = zlib.compressobj(compression)
+        self._pending = []
+        self._pending_size = 0
+
+        color_type = {3: 2, 4: 6}[channels]
+        self.file.write(PNG_SIGNATURE)
+        self._chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def _compressed(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._chunk('IDAT', ''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def write_rows(self, rows):
+        """ Append a (rows, width, channels) uint8 band of the image, top row first. """
+        if rows.shape[1:] != (self.width, self.channels):
+            raise ValueError("Expected rows of shape (n, %d, %d), got %r" % (self.width, self.channels, rows.shape))
+        if self.rows + len(rows) > self.height:
+            raise ValueError("Image only has %d rows" % self.height)
+
+        # Each scanline starts with its filter type, 0 for none
+        scanlines = np.zeros((len(rows), self.width * self.channels + 1), dtype=np.uint8)
+        scanlines[:, 1:] = rows.reshape(len(rows), -1)
+        self._compressed(self.compressor.compress(scanlines.tostring()))
+        self.rows += len(rows)
+
+    def close(self):
+        if self.rows != self.height:
+            self.abort()
+            raise ValueError("Only %d of %d rows were written" % (self.rows, self.height))
+        self._compressed(self.compressor.flush())
+        self._flush()
+        self._chunk('IEND', '')
+        self.file.close()
+        os.rename(self.file.name, self.path)
+
+    def abort(self):
+        """ Close and delete the partly written image. """
+        self.file.close()
+        os.remove(self.file.name)
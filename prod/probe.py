@@ -0,0 +1,45 @@
+from collections import OrderedDict
+import numpy as np
+
+# Candidates are rendered this small first, and scored to decide if they're worth a full render
+PROBE_SIZE = (80, 60)
+
+# Pixels darker than this are taken to be background the rays missed
+HIT_LUMINANCE = 0.02
+# Luminance steps between neighbouring pixels bigger than this count as edges
+EDGE_STEP = 0.1
+
+# Lowest scores a candidate may have to be rendered in full
+PROBE_THRESHOLDS = OrderedDict([
+    ('coverage', 0.05),
+    ('color_variance', 0.01),
+    ('edge_density', 0.05),
+])
+
+
+def score_image(image):
+    """
+    Scores of an (height, width, 3 or 4) uint8 image: `coverage`, the
+    fraction of pixels that hit the fractal, `color_variance`, the variance
+    of the hit pixels' colours, and `edge_density`, the fraction of pixels
+    on an edge. Nearly empty images have low coverage, washed out ones low
+    colour variance, and featureless ones few edges.
+    """
+    rgb = image[..., :3].astype(np.float32) / 255
+    luminance = rgb.dot(np.array((0.299, 0.587, 0.114), dtype=np.float32))
+    hits = luminance > HIT_LUMINANCE
+
+    edges = np.zeros(luminance.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(luminance, axis=1)) > EDGE_STEP
+    edges[1:, :] |= np.abs(np.diff(luminance, axis=0)) > EDGE_STEP
+
+    return OrderedDict([
+        ('coverage', float(hits.mean())),
+        ('color_variance', float(rgb[hits].var(axis=0).mean()) if hits.any() else 0.0),
+        ('edge_density', float(edges.mean())),
+    ])
+
+
+def failed_thresholds(scores, thresholds=PROBE_THRESHOLDS):
+    """ Names of the scores below their threshold, empty if the candidate passes. """
+    return [name for name, threshold in thresholds.iteritems() if scores[name] < threshold]
@@ -0,0 +1,174 @@
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from vispy import gloo
+from vispy.gloo import get_current_canvas
+from vispy.gloo.gl.gl2 import _get_gl_func
+import ctypes
+import json
+import numpy as np
+import re
+import time
+
+GL_QUERY_RESULT = 0x8866
+GL_QUERY_RESULT_AVAILABLE = 0x8867
+GL_TIME_ELAPSED = 0x88BF
+
+PERCENTILES = (50, 95, 99)
+
+
+class GPUTimer(object):
+    """
+    Times the GPU work issued between `begin` and `end` with timer queries.
+    Results are collected by `results` once the GPU has finished them, a
+    frame or two later, so the CPU never waits on the GPU. `supported` is
+    False if the driver doesn't have timer queries (GL 3.3 or
+    ARB_timer_query), and queries can't be nested.
+    """
+
+    def __init__(self):
+        version = re.match(r'(\d+)\.(\d+)', gloo.gl.glGetParameter(gloo.gl.GL_VERSION))
+        extensions = gloo.gl.glGetParameter(gloo.gl.GL_EXTENSIONS).split()
+        self.supported = bool(version and (int(version.group(1)), int(version.group(2))) >= (3, 3)) or 'GL_ARB_timer_query' in extensions
+
+        if self.supported:
+            try:
+                self._gen_queries = _get_gl_func('glGenQueries', None, (ctypes.c_int, ctypes.POINTER(ctypes.c_uint)))
+                self._begin_query = _get_gl_func('glBeginQuery', None, (ctypes.c_uint, ctypes.c_uint))
+                self._end_query = _get_gl_func('glEndQuery', None, (ctypes.c_uint,))
+                self._get_query_int = _get_gl_func('glGetQueryObjectiv', None, (ctypes.c_uint, ctypes.c_uint, ctypes.POINTER(ctypes.c_int)))
+                self._get_query_uint64 = _get_gl_func('glGetQueryObjectui64v', None, (ctypes.c_uint, ctypes.c_uint, ctypes.POINTER(ctypes.c_uint64)))
+            except RuntimeError:
+                self.supported = False
+
+        self._free = []
+        self._pending = deque()
+        self._active = None
+
+    def begin(self, name):
+        if self._free:
+            query = self._free.pop()
+        else:
+            query = ctypes.c_uint(0)
+            self._gen_queries(1, ctypes.byref(query))
+            query = query.value
+        self._begin_query(GL_TIME_ELAPSED, query)
+        self._active = (name, query)
+
+    def end(self):
+        self._end_query(GL_TIME_ELAPSED)
+        self._pending.append(self._active)
+        self._active = None
+
+    def results(self):
+        """ (name, seconds) for each finished query, oldest first. """
+        results = []
+        available = ctypes.c_int(0)
+        elapsed = ctypes.c_uint64(0)
+        while self._pending:
+            name, query = self._pending[0]
+            self._get_query_int(query, GL_QUERY_RESULT_AVAILABLE, ctypes.byref(available))
+            if not available.value:
+                break
+            self._get_query_uint64(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+            self._pending.popleft()
+            self._free.append(query)
+            results.append((name, elapsed.value * 1e-9))
+        return results
+
+
+class FrameProfiler(object):
+    """
+    Per-stage timings for a frame loop. Wrap each stage in `with
+    profiler.stage(name):` and call `end_frame` once per frame. vispy queues
+    GL commands until the end of the draw event, so they're flushed at stage
+    boundaries to charge GL work to the stage that issued it. With `gpu`,
+    stages are also timed with GPU timer queries where the driver has them.
+
+    The last `window` samples of each stage are kept for percentiles, and a
+    summary line is printed every `summary_interval` seconds. A disabled
+    profiler's stages do nothing.
+    """
+
+    def __init__(self, enabled=True, window=300, summary_interval=5.0, gpu=True):
+        self.enabled = enabled
+        self.window = window
+        self.summary_interval = summary_interval
+        self.cpu = OrderedDict()
+        self.gpu = OrderedDict()
+        self.frames = 0
+
+        self.gpu_timer = GPUTimer() if enabled and gpu else None
+        if self.gpu_timer is not None and not self.gpu_timer.supported:
+            print "GPU timer queries aren't supported, only timing stages on the CPU"
+            self.gpu_timer = None
+
+        self._last_frame = None
+        self._last_summary = time.time()
+
+    def _record(self, samples, name, seconds):
+        if name not in samples:
+            samples[name] = deque(maxlen=self.window)
+        samples[name].append(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        context = get_current_canvas().context
+        context.flush_commands()
+        if self.gpu_timer is not None:
+            self.gpu_timer.begin(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            context.flush_commands()
+            self._record(self.cpu, name, time.time() - start)
+            if self.gpu_timer is not None:
+                self.gpu_timer.end()
+
+    def end_frame(self, now=None):
+        if not self.enabled:
+            return
+
+        now = now or time.time()
+        if self._last_frame is not None:
+            self._record(self.cpu, 'frame', now - self._last_frame)
+        self._last_frame = now
+        self.frames += 1
+
+        if self.gpu_timer is not None:
+            for name, seconds in self.gpu_timer.results():
+                self._record(self.gpu, name, seconds)
+
+        if self.summary_interval and now - self._last_summary >= self.summary_interval:
+            self._last_summary = now
+            print self.summary()
+
+    def stats(self):
+        """ Count, mean and percentiles in milliseconds of each stage's recent CPU and GPU samples. """
+        stats = {'frames': self.frames, 'cpu': OrderedDict(), 'gpu': OrderedDict()}
+        for kind, stages in (('cpu', self.cpu), ('gpu', self.gpu)):
+            for name, samples in stages.iteritems():
+                milliseconds = np.array(samples) * 1000
+                stats[kind][name] = OrderedDict([('count', len(milliseconds)), ('mean', float(milliseconds.mean()))])
+                for percentile, value in zip(PERCENTILES, np.percentile(milliseconds, PERCENTILES)):
+                    stats[kind][name]['p%d' % percentile] = float(value)
+        return stats
+
+    def summary(self):
+        stats = self.stats()
+        parts = []
+        for name, stage in stats['cpu'].iteritems():
+            part = '%s %s' % (name, '/'.join('%.1f' % stage['p%d' % percentile] for percentile in PERCENTILES))
+            if name in stats['gpu']:
+                part += ' (gpu %s)' % '/'.join('%.1f' % stats['gpu'][name]['p%d' % percentile] for percentile in PERCENTILES)
+            parts.append(part)
+        return 'Frame %d, p%s ms: %s' % (self.frames, '/p'.join(str(percentile) for percentile in PERCENTILES), ' | '.join(parts))
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.stats(), f, indent=2)
+        print "Wrote frame profile to %s" % path
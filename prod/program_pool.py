@@ -0,0 +1,169 @@
+from vispy import gloo
+from vispy.gloo import get_current_canvas
+import time
+from fractal import FractalProgram, definition_variants, choose_variant, reload_shaders
+from quality import DEFAULT_QUALITY, quality_defines
+
+
+class FractalProgramPool(object):
+    """
+    Keeps one compiled and linked `FractalProgram` per shader variant so that
+    switching definitions only resets uniforms instead of recompiling GLSL on
+    the render thread. Programs can be compiled all at once with `warm`, or
+    one at a time from an idle timer with `warm_next`.
+
+    After the shader files change, `reload` queues every program to be
+    compiled again by `warm_next`. Each new program replaces its old one only
+    once it has compiled and linked, and if that fails the old one is kept.
+    `replacement` gives the program that took over from one in use.
+
+    A variant that fails to compile for the first time is recorded in
+    `compile_errors` and queued again by the next `reload`, and `get` falls
+    back to a program already compiled for the same distance estimator.
+
+    `quality` is a tier from quality.py, or a dict of tiers by definition name.
+    """
+
+    def __init__(self, definitions, mask=False, defines=None, quality=DEFAULT_QUALITY):
+        self.mask = mask
+        self.defines = defines
+        self.quality = quality
+        self.programs = {}
+        self.compile_times = []
+        self.compile_errors = []
+
+        self._pending = []
+        self._reloads = []
+        self._failed = []
+        self.queue(definitions)
+
+    def queue(self, definitions):
+        """ Queue the variants of `definitions` for `warm_next`, like definitions that were just reloaded. """
+        for definition in definitions:
+            for variant in definition_variants(definition):
+                self._failed = [(failed_variant, failed_definition) for failed_variant, failed_definition in self._failed if failed_variant != variant]
+                if variant not in [pending_variant for pending_variant, _ in self._pending]:
+                    self._pending.append((variant, definition))
+
+    def quality_for(self, definition):
+        if isinstance(self.quality, dict):
+            return self.quality.get(definition['name'], DEFAULT_QUALITY)
+        return self.quality
+
+    @property
+    def warm(self):
+        return len(self._pending) == 0 and len(self._reloads) == 0
+
+    def warm_up(self):
+        while self.warm_next():
+            pass
+
+    def warm_next(self, event=None):
+        """ Compile the next pending variant. Returns True while more are pending. """
+        if self._reloads:
+            self._recompile(self._reloads.pop(0))
+        elif self._pending:
+            variant, definition = self._pending.pop(0)
+            quality = self.quality_for(definition)
+            if (variant, quality) not in self.programs:
+                self._try_compile(variant, quality, definition)
+        return not self.warm
+
+    def get(self, definition, quality=None, variant=None):
+        """
+        The program for `variant` of `definition`, a random one by default,
+        compiling it if needed. If it doesn't compile, any program already
+        compiled for the definition's distance estimator is used instead, and
+        without one the RuntimeError is raised. A requested `variant` is
+        never swapped for another.
+        """
+        requested = variant
+        variant = variant or choose_variant(definition)
+        quality = quality or self.quality_for(definition)
+        if (variant, quality) not in self.programs and not self._try_compile(variant, quality, definition):
+            program = None if requested else self.compiled(definition, quality)
+            if program is None:
+                raise RuntimeError("No %s program compiles for %s, see compile_errors" % (variant, definition['name']))
+            return program
+
+        program = self.programs[(variant, quality)]
+        program.use_definition(definition)
+        return program
+
+    def compiled(self, definition, quality=None):
+        """ A program already compiled for `definition`'s distance estimator, set up for it, or None. """
+        quality = quality or self.quality_for(definition)
+        for variant, program_quality in sorted(self.programs):
+            if variant[0] == definition['distance_estimator'] and program_quality == quality:
+                program = self.programs[(variant, program_quality)]
+                program.use_definition(definition)
+                return program
+        return None
+
+    def reload(self):
+        """ Queue every compiled program to be compiled again from the shader files. """
+        reload_shaders()
+        self._reloads = [key for key in sorted(self.programs) if key not in self._reloads] + self._reloads
+        self._pending += self._failed
+        self._failed = []
+
+    def replacement(self, program):
+        """ The program now compiled for `program`'s variant and quality, `program` itself unless it was reloaded. """
+        return self.programs.get((program.variant, program.quality), program)
+
+    def prune(self, definitions):
+        """ Delete programs compiled at qualities none of `definitions` use any more. """
+        used = set((definition['distance_estimator'], self.quality_for(definition)) for definition in definitions)
+        for variant, quality in self.programs.keys():
+            if (variant[0], quality) not in used:
+                self.programs.pop((variant, quality)).delete()
+
+    def _compile(self, variant, quality, definition):
+        start = time.time()
+        program = FractalProgram(definition, mask=self.mask, variant=variant, defines=quality_defines(quality, self.defines))
+        program.quality = quality
+
+        # vispy only compiles and links once the program's commands reach the
+        # context, which normally happens on the first draw. Flush them now,
+        # after anything already queued so a failure only loses this program.
+        context = get_current_canvas().context
+        context.flush_commands()
+        context.glir.associate(program.glir)
+        try:
+            gloo.finish()
+        except RuntimeError:
+            program.delete()
+            raise
+
+        self.programs[(variant, quality)] = program
+        self.compile_times.append((definition['name'], variant, quality, time.time() - start))
+
+    def _try_compile(self, variant, quality, definition):
+        # Returns False and keeps the variant for the next reload if it fails to compile
+        try:
+            self._compile(variant, quality, definition)
+        except RuntimeError as e:
+            self.compile_errors.append((variant, quality, str(e)))
+            if variant not in [failed_variant for failed_variant, _ in self._failed]:
+                self._failed.append((variant, definition))
+            print "Couldn't compile the %s program at %s quality, retrying after the shaders change:\n%s" % (variant, quality, e)
+            return False
+        return True
+
+    def _recompile(self, key):
+        old = self.programs.get(key)
+        if old is None:
+            return
+        variant, quality = key
+        try:
+            self._compile(variant, quality, old.definition)
+        except RuntimeError as e:
+            self.compile_errors.append((variant, quality, str(e)))
+            print "Keeping the running %s program at %s quality, the new shaders failed:\n%s" % (variant, quality, e)
+            return
+        old.delete()
+
+    def report(self):
+        for name, variant, quality, seconds in self.compile_times:
+            print "Compiled %s variant %s at %s quality in %.3fs" % (name, variant, quality, seconds)
+        print "Compiled %d fractal programs in %.3fs" % (len(self.compile_times), sum(seconds for _, _, _, seconds in self.compile_times))
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from vispy import gloo
+import time
+from resolution import RenderTarget
+
+# Shader constants for each quality tier, cheapest first. 'high' matches the
+# defaults in fractal.frag.
+QUALITY_PRESETS = OrderedDict([
+    ('low', {'RAY_DEPTH': 96, 'SHADOW_RAY_DEPTH': 8, 'AO_SAMPLES': 2, 'MAX_DEPTH': 40.0, 'DISTANCE_MIN': 0.02, 'ANTIALIAS_SAMPLES': 1}),
+    ('medium', {'RAY_DEPTH': 160, 'SHADOW_RAY_DEPTH': 16, 'AO_SAMPLES': 3, 'MAX_DEPTH': 60.0, 'DISTANCE_MIN': 0.015, 'ANTIALIAS_SAMPLES': 2}),
+    ('high', {'RAY_DEPTH': 256, 'SHADOW_RAY_DEPTH': 32, 'AO_SAMPLES': 5, 'MAX_DEPTH': 100.0, 'DISTANCE_MIN': 0.01, 'ANTIALIAS_SAMPLES': 4}),
+    ('ultra', {'RAY_DEPTH': 384, 'SHADOW_RAY_DEPTH': 64, 'AO_SAMPLES': 8, 'MAX_DEPTH': 100.0, 'DISTANCE_MIN': 0.005, 'ANTIALIAS_SAMPLES': 8}),
+])
+DEFAULT_QUALITY = 'high'
+
+
+def quality_defines(quality, defines=None):
+    """ Shader defines for a quality tier, with any entries in `defines` taking precedence. """
+    result = dict(QUALITY_PRESETS[quality])
+    result.update(defines or {})
+    return result
+
+
+def calibrate(fractals, definitions, size, render=None, frames=3):
+    """
+    Time each definition at each quality tier by drawing `frames` frames at
+    `size` (width, height) into an offscreen target, after one untimed frame.
+    `fractals` is a `FractalProgramPool`, `render(fractal, size)` replaces
+    `fractal.draw` for pipelines that draw the fractal in more than one pass.
+    Returns {(definition name, quality): seconds per frame}.
+    """
+    target = RenderTarget(size)
+    timings = {}
+    for quality in QUALITY_PRESETS:
+        for definition in definitions:
+            fractal = fractals.get(definition, quality=quality)
+            fractal['resolution'] = size
+
+            with target.framebuffer:
+                gloo.set_viewport(0, 0, *size)
+                for frame in range(frames + 1):
+                    if frame == 1:
+                        gloo.finish()
+                        start = time.time()
+                    fractal['time'] = float(frame)
+                    if render is not None:
+                        render(fractal, size)
+                    else:
+                        fractal.draw()
+                gloo.finish()
+
+            timings[(definition['name'], quality)] = (time.time() - start) / frames
+            print "Calibrated %s at %s quality: %.1fms per frame" % (definition['name'], quality, timings[(definition['name'], quality)] * 1000)
+    return timings
+
+
+def pick_qualities(timings, definitions, frame_budget):
+    """
+    The highest quality tier for each definition whose calibrated frame time
+    fits in `frame_budget` seconds, or the lowest tier if none do. Returns
+    {definition name: quality}.
+    """
+    qualities = {}
+    for definition in definitions:
+        fitting = [quality for quality in QUALITY_PRESETS if timings[(definition['name'], quality)] <= frame_budget]
+        qualities[definition['name']] = fitting[-1] if fitting else QUALITY_PRESETS.keys()[0]
+    return qualities
@@ -0,0 +1,61 @@
+from vispy import gloo
+import numpy as np
+import time
+
+# Scales are snapped to this step so the render target isn't reallocated every frame
+SCALE_STEP = 1 / 32.0
+
+
+class ResolutionController(object):
+    """
+    Picks the fractal render scale for each frame from how long recent frames
+    took. Raymarching cost is roughly proportional to the number of pixels,
+    so the scale moves towards sqrt(target / frame time) of its current value.
+    """
+
+    def __init__(self, target_frame_time, min_scale=0.25, max_scale=1.0, gain=0.3, smoothing=0.8):
+        self.target_frame_time = target_frame_time
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.gain = gain
+        self.smoothing = smoothing
+
+        self.scale = max_scale
+        self.frame_time = target_frame_time
+        self._last_frame = None
+
+    def update(self, now=None):
+        now = now or time.time()
+        if self._last_frame is not None:
+            self.frame_time = self.smoothing * self.frame_time + (1 - self.smoothing) * (now - self._last_frame)
+            desired_scale = self.scale * np.sqrt(self.target_frame_time / max(self.frame_time, 1e-6))
+            self.scale = float(np.clip(self.scale + self.gain * (desired_scale - self.scale), self.min_scale, self.max_scale))
+        self._last_frame = now
+
+        return self.snapped_scale
+
+    @property
+    def snapped_scale(self):
+        return max(self.min_scale, round(self.scale / SCALE_STEP) * SCALE_STEP)
+
+
+class RenderTarget(object):
+    """ A colour texture, linearly filtered by default, with a framebuffer to render into it. """
+
+    def __init__(self, size=(1, 1), internalformat=None, interpolation='linear'):
+        width, height = size
+        self.texture = gloo.Texture2D(shape=(height, width, 4), interpolation=interpolation, internalformat=internalformat)
+        self.framebuffer = gloo.FrameBuffer(color=self.texture)
+
+    @property
+    def size(self):
+        height, width = self.texture.shape[:2]
+        return width, height
+
+    def resize(self, size):
+        """ Resize to (width, height), returns True if the size changed. """
+        if tuple(size) == self.size:
+            return False
+        width, height = size
+        self.framebuffer.resize((height, width))
+        return True
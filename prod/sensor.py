@@ -0,0 +1,159 @@
+from collections import namedtuple
+from depth import depth_view
+import numpy as np
+import threading
+import time
+
+try:
+    from primesense import nite2
+except ImportError:
+    # Recorded skeletons can still be replayed without OpenNI/NiTE, see skeleton_recording.py
+    nite2 = None
+
+JOINT_COUNT = 15
+MIN_CONFIDENCE = 0.2
+
+# NiteSkeletonState.NITE_SKELETON_TRACKED
+SKELETON_TRACKED = 2
+
+
+class JointType(object):
+    """ Joint indices, the same as NiteJointType. """
+    NITE_JOINT_HEAD = 0
+    NITE_JOINT_NECK = 1
+    NITE_JOINT_LEFT_SHOULDER = 2
+    NITE_JOINT_RIGHT_SHOULDER = 3
+    NITE_JOINT_LEFT_ELBOW = 4
+    NITE_JOINT_RIGHT_ELBOW = 5
+    NITE_JOINT_LEFT_HAND = 6
+    NITE_JOINT_RIGHT_HAND = 7
+    NITE_JOINT_TORSO = 8
+    NITE_JOINT_LEFT_HIP = 9
+    NITE_JOINT_RIGHT_HIP = 10
+    NITE_JOINT_LEFT_KNEE = 11
+    NITE_JOINT_RIGHT_KNEE = 12
+    NITE_JOINT_LEFT_FOOT = 13
+    NITE_JOINT_RIGHT_FOOT = 14
+
+
+class UserSample(namedtuple('UserSample', ['id', 'new', 'visible', 'lost', 'skeleton_state', 'center_of_mass', 'positions', 'confidences'])):
+    """
+    One user from a NiTE frame, copied out of the frame so it can be used
+    after the sensor thread has moved on. `positions` is a (15, 3) array in
+    millimetres and `confidences` a (15,) array, both indexed by
+    NiteJointType.
+    """
+
+    @property
+    def tracked(self):
+        return self.skeleton_state == SKELETON_TRACKED and self.visible
+
+
+# `silhouette` is the bool mask of a SilhouetteSegmenter when the sensor thread has one
+SkeletonSample = namedtuple('SkeletonSample', ['index', 'timestamp', 'users', 'silhouette'])
+SkeletonSample.__new__.__defaults__ = (None,)
+
+
+def user_sample(user):
+    positions = np.zeros((JOINT_COUNT, 3))
+    confidences = np.zeros(JOINT_COUNT)
+    if user.skeleton.state == SKELETON_TRACKED:
+        for i, joint in enumerate(user.skeleton.joints):
+            positions[i] = (joint.position.x, joint.position.y, joint.position.z)
+            confidences[i] = joint.positionConfidence
+
+    return UserSample(user.id, user.is_new(), user.is_visible(), user.is_lost(), user.skeleton.state,
+                      np.array((user.centerOfMass.x, user.centerOfMass.y, user.centerOfMass.z)), positions, confidences)
+
+
+class SensorThread(threading.Thread):
+    """
+    Reads NiTE user tracker frames on its own thread, so the render loop never
+    waits on the sensor. Each frame's users are copied into a `SkeletonSample`
+    which replaces `_latest`, a single reference assignment, so readers need
+    no lock.
+
+    `read` returns the newest sample, counting samples that were replaced
+    before anyone read them as `dropped`, and reads that found nothing new
+    as `stale`. Samples older than `max_age` seconds count as no sample at
+    all, so a stalled sensor doesn't freeze the last pose on screen. Every
+    sample is also written to `recorder` if there is one. With a
+    `segmenter`, a `SilhouetteSegmenter`, each sample also carries the
+    silhouette it segmented from the frame's depth.
+    """
+
+    def __init__(self, smoothing=0.3, max_age=0.5, recorder=None, segmenter=None):
+        super(SensorThread, self).__init__()
+        self.daemon = True
+        self.smoothing = smoothing
+        self.max_age = max_age
+        self.recorder = recorder
+        self.segmenter = segmenter
+
+        self.dropped = 0
+        self.stale = 0
+        self.errors = 0
+
+        self.running = True
+        self._reset = True
+        self._latest = None
+        self._read_index = None
+
+    def silhouette(self, depth):
+        """ The segmenter's silhouette of a (height, width) uint16 depth frame in millimetres. """
+        return self.segmenter(depth)
+
+    def reset(self):
+        """ Recreate the user tracker on the sensor thread before its next frame. """
+        self._reset = True
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        index = 0
+        while self.running:
+            try:
+                if self._reset:
+                    self._reset = False
+                    self.user_tracker = nite2.UserTracker(False)
+                    self.user_tracker.skeleton_smoothing_factor = self.smoothing
+
+                frame = self.user_tracker.read_frame()
+                for user in frame.users:
+                    if user.is_new():
+                        self.user_tracker.start_skeleton_tracking(user.id)
+
+                    if user.is_lost():
+                        self.user_tracker.stop_skeleton_tracking(user.id)
+
+                silhouette = self.silhouette(depth_view(frame.get_depth_frame())) if self.segmenter is not None else None
+                sample = SkeletonSample(index, time.time(), [user_sample(user) for user in frame.users], silhouette)
+            except Exception as e:
+                # Keep the sensor thread alive through hiccups, the render loop sees them as stale reads
+                self.errors += 1
+                print "Sensor read failed: %s" % e
+                time.sleep(0.1)
+                continue
+
+            if self.recorder is not None:
+                self.recorder.write(sample)
+            self._latest = sample
+            index += 1
+
+    def read(self, elapsed=None):
+        # Live samples are always the newest, `elapsed` is for replayed ones
+        sample = self._latest
+        if sample is None or time.time() - sample.timestamp > self.max_age:
+            self.stale += 1
+            return None
+
+        if sample.index == self._read_index:
+            self.stale += 1
+        elif self._read_index is not None:
+            self.dropped += sample.index - self._read_index - 1
+        self._read_index = sample.index
+        return sample
+
+    def __str__(self):
+        return "sensor: %d samples, %d dropped, %d stale reads, %d errors" % (self._latest.index + 1 if self._latest else 0, self.dropped, self.stale, self.errors)
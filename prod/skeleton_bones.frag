@@ -1,11 +1,20 @@
+uniform bool u_lines;
 varying vec4 v_fg_color;
 varying vec4 v_bg_color;
 varying float v_radius;
 varying float v_linewidth;
 varying float v_antialias;
+varying float v_visible;
 
 void main()
 {
+    if (u_lines) {
+        if (v_visible < 0.999)
+            discard;
+        gl_FragColor = v_fg_color;
+        return;
+    }
+
     float size = 2.0*(v_radius + v_linewidth + 1.5*v_antialias);
     float t = v_linewidth/2.0-v_antialias;
     float r = length((gl_PointCoord.xy - vec2(0.5,0.5))*size);
@@ -1,18 +1,72 @@
 from vispy import gloo
 import numpy as np
+from sensor import JointType as JT, JOINT_COUNT, MIN_CONFIDENCE
 from utils import read_shader
-from primesense import _nite2
+
+# NiTE tracks at most this many users, any more aren't drawn
+MAX_USERS = 6
+
+BONES = [
+    (JT.NITE_JOINT_HEAD, JT.NITE_JOINT_NECK),
+    (JT.NITE_JOINT_NECK, JT.NITE_JOINT_LEFT_SHOULDER),
+    (JT.NITE_JOINT_NECK, JT.NITE_JOINT_RIGHT_SHOULDER),
+    (JT.NITE_JOINT_LEFT_SHOULDER, JT.NITE_JOINT_LEFT_ELBOW),
+    (JT.NITE_JOINT_LEFT_ELBOW, JT.NITE_JOINT_LEFT_HAND),
+    (JT.NITE_JOINT_RIGHT_SHOULDER, JT.NITE_JOINT_RIGHT_ELBOW),
+    (JT.NITE_JOINT_RIGHT_ELBOW, JT.NITE_JOINT_RIGHT_HAND),
+    (JT.NITE_JOINT_LEFT_SHOULDER, JT.NITE_JOINT_TORSO),
+    (JT.NITE_JOINT_RIGHT_SHOULDER, JT.NITE_JOINT_TORSO),
+    (JT.NITE_JOINT_TORSO, JT.NITE_JOINT_LEFT_HIP),
+    (JT.NITE_JOINT_TORSO, JT.NITE_JOINT_RIGHT_HIP),
+    (JT.NITE_JOINT_LEFT_HIP, JT.NITE_JOINT_RIGHT_HIP),
+    (JT.NITE_JOINT_LEFT_HIP, JT.NITE_JOINT_LEFT_KNEE),
+    (JT.NITE_JOINT_LEFT_KNEE, JT.NITE_JOINT_LEFT_FOOT),
+    (JT.NITE_JOINT_RIGHT_HIP, JT.NITE_JOINT_RIGHT_KNEE),
+    (JT.NITE_JOINT_RIGHT_KNEE, JT.NITE_JOINT_RIGHT_FOOT),
+]
+
+VERTEX_DTYPE = np.dtype([('a_position', np.float32, 3), ('a_visible', np.float32)])
 
 
 class SkeletonBonesProgram(gloo.Program):
+    """
+    Draws the joints and bones of every tracked user in a sample. The
+    vertices of all MAX_USERS skeletons live in one buffer that's allocated
+    once and updated in place, with joints of untracked users or low
+    confidence hidden by `a_visible`, so each frame is a single sub-data
+    upload, one draw of the joints as points and one of the bones as lines.
+    """
 
     def __init__(self):
         super(SkeletonBonesProgram, self).__init__(read_shader('skeleton_bones.vert'), read_shader('skeleton_bones.frag'))
-        self['a_position'] = gloo.VertexBuffer()
+        self.vertices = np.zeros(MAX_USERS * JOINT_COUNT, dtype=VERTEX_DTYPE)
+        self.vertex_buffer = gloo.VertexBuffer(self.vertices)
+        self.bind(self.vertex_buffer)
+
+        bones = np.array(BONES, dtype=np.uint32)
+        self.bone_indices = gloo.IndexBuffer(np.concatenate([bones + user * JOINT_COUNT for user in range(MAX_USERS)]).ravel())
+        self._drawn_users = 0
+
+    def update(self, sample):
+        users = sample.users[:MAX_USERS] if sample is not None else []
+        skeletons = self.vertices.reshape(MAX_USERS, JOINT_COUNT)
+        for skeleton, user in zip(skeletons, users):
+            skeleton['a_position'][:, :2] = user.positions[:, :2] / 1000.0
+            skeleton['a_visible'] = user.tracked & (user.confidences >= MIN_CONFIDENCE)
+
+        # Only the slots in use now or last frame need uploading, the rest are already hidden
+        skeletons[len(users):]['a_visible'] = 0
+        count = max(len(users), self._drawn_users) * JOINT_COUNT
+        if count:
+            self.vertex_buffer.set_subdata(self.vertices[:count], copy=True)
+        self._drawn_users = len(users)
 
-    def draw(self, user_tracker_frame):
-        for user in user_tracker_frame.users:
-            joint_positions = np.asarray(list((joint.position.x / 1000.0, joint.position.y / 1000.0, 0) for joint in user.skeleton.joints), dtype=np.float32)
-            self['a_position'] = gloo.VertexBuffer(joint_positions)
+    def draw(self, sample):
+        self.update(sample)
+        if not self._drawn_users:
+            return
 
+        self['u_lines'] = True
+        super(SkeletonBonesProgram, self).draw('lines', self.bone_indices)
+        self['u_lines'] = False
         super(SkeletonBonesProgram, self).draw('points')
@@ -1,9 +1,11 @@
 attribute vec3  a_position;
+attribute float a_visible;
 varying vec4 v_fg_color;
 varying vec4 v_bg_color;
 varying float v_radius;
 varying float v_linewidth;
 varying float v_antialias;
+varying float v_visible;
 
 
 void main (void) {
@@ -12,6 +14,8 @@ void main (void) {
     v_antialias = 1.0;
     v_fg_color  = vec4(0.0,0.0,0.0,0.5);
     v_bg_color  = vec4(0.5, 0.4, 0.6, 1.0);
-    gl_Position = vec4(a_position, 1.0);
+    v_visible = a_visible;
+    // Hidden joints go outside the clip volume, and the fragment shader drops bones touching them
+    gl_Position = a_visible > 0.5 ? vec4(a_position, 1.0) : vec4(2.0, 2.0, 2.0, 1.0);
     gl_PointSize = 2.0*(v_radius + v_linewidth + 1.5*v_antialias);
 }
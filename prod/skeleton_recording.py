@@ -0,0 +1,167 @@
+import numpy as np
+from sensor import JOINT_COUNT, SkeletonSample, UserSample
+
+MAGIC = 'BFSKEL'
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([('magic', 'S6'), ('version', '<u2'), ('joint_count', '<u4'), ('record_size', '<u4'), ('reserved', '<u4', (5,))])
+
+# One record per user per frame, and a single record with user id 0 for frames without users.
+# joints holds x, y, z in millimetres and the confidence for each NiteJointType.
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('frame', '<u4'),
+    ('user_id', '<u2'),
+    ('state', '<u1'),
+    ('flags', '<u1'),
+    ('center_of_mass', '<f4', (3,)),
+    ('joints', '<f4', (JOINT_COUNT, 4)),
+])
+
+NEW, VISIBLE, LOST = 1, 2, 4
+
+
+class SkeletonRecorder(object):
+    """
+    Writes `SkeletonSample`s to a file of fixed size records after a header,
+    see `load_recording`. Pass one as a `SensorThread`'s recorder to record
+    the live sensor.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['joint_count'] = JOINT_COUNT
+        header['record_size'] = RECORD_DTYPE.itemsize
+        header.tofile(self.file)
+
+    def write(self, sample):
+        records = np.zeros(max(len(sample.users), 1), dtype=RECORD_DTYPE)
+        records['timestamp'] = sample.timestamp
+        records['frame'] = sample.index
+        for record, user in zip(records, sample.users):
+            record['user_id'] = user.id
+            record['state'] = user.skeleton_state
+            record['flags'] = NEW * user.new | VISIBLE * user.visible | LOST * user.lost
+            record['center_of_mass'] = user.center_of_mass
+            record['joints'][:, :3] = user.positions
+            record['joints'][:, 3] = user.confidences
+        records.tofile(self.file)
+
+    def close(self):
+        self.file.close()
+
+
+def load_recording(path):
+    """ Memory map a recording as a structured array of `RECORD_DTYPE` records. """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != MAGIC:
+        raise ValueError("%s isn't a skeleton recording" % path)
+    if header['version'][0] != VERSION or header['record_size'][0] != RECORD_DTYPE.itemsize or header['joint_count'][0] != JOINT_COUNT:
+        raise ValueError("%s is a version %d recording with %d byte records, expected version %d" % (path, header['version'][0], header['record_size'][0], VERSION))
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize)
+
+
+def frame_sample(index, records):
+    """ The `SkeletonSample` for one frame's records. """
+    users = [UserSample(int(record['user_id']), bool(record['flags'] & NEW), bool(record['flags'] & VISIBLE), bool(record['flags'] & LOST),
+                        int(record['state']), record['center_of_mass'].astype(np.float64),
+                        record['joints'][:, :3].astype(np.float64), record['joints'][:, 3].astype(np.float64))
+             for record in records if record['user_id'] != 0]
+    return SkeletonSample(index, float(records['timestamp'][0]), users)
+
+
+class ReplaySensor(object):
+    """
+    Plays a recording back with the same `read` as `SensorThread`. In real
+    time the sample for the `elapsed` seconds passed to `read` is returned,
+    otherwise each read returns the next frame as fast as they're asked for.
+    With `loop` playback wraps around at the end, without it reads past the
+    end return None.
+    """
+
+    def __init__(self, path, realtime=True, loop=True):
+        self.records = load_recording(path)
+        if len(self.records) == 0:
+            raise ValueError("%s has no frames" % path)
+        self.realtime = realtime
+        self.loop = loop
+
+        # Index of each frame's first record, and the frame times relative to the first
+        self.starts = np.concatenate(([0], np.flatnonzero(np.diff(self.records['frame'])) + 1, [len(self.records)]))
+        self.times = self.records['timestamp'][self.starts[:-1]] - self.records['timestamp'][0]
+        self.duration = self.times[-1] + (self.times[-1] / max(len(self.times) - 1, 1))
+
+        self.dropped = 0
+        self.stale = 0
+        self.reset()
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def reset(self):
+        self._next = 0
+        self._read_index = None
+
+    def read(self, elapsed=None):
+        if self.realtime:
+            elapsed = elapsed or 0.0
+            if self.loop:
+                elapsed %= self.duration
+            index = np.searchsorted(self.times, elapsed, side='right') - 1
+        else:
+            index = self._next
+            self._next += 1
+            if self.loop:
+                index %= len(self)
+        if index < 0 or index >= len(self):
+            return None
+
+        if index == self._read_index:
+            self.stale += 1
+        elif self._read_index is not None and index > self._read_index:
+            self.dropped += index - self._read_index - 1
+        self._read_index = index
+        return frame_sample(index, self.records[self.starts[index]:self.starts[index + 1]])
+
+    def __str__(self):
+        return "replay: %d frames, %d dropped, %d stale reads" % (len(self), self.dropped, self.stale)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    import time
+    parser = OptionParser(usage="%prog record|replay PATH")
+    parser.add_option("-s", "--seconds", type="float", default=30)
+
+    (options, args) = parser.parse_args()
+    if len(args) != 2 or args[0] not in ('record', 'replay'):
+        parser.error("expected record or replay and a path")
+    command, path = args
+
+    if command == 'record':
+        from primesense import nite2, openni2
+        from sensor import SensorThread
+        openni2.initialize()
+        nite2.initialize()
+
+        recorder = SkeletonRecorder(path)
+        sensor = SensorThread(recorder=recorder)
+        sensor.start()
+        time.sleep(options.seconds)
+        sensor.stop()
+        sensor.join()
+        recorder.close()
+        print "Recorded %s" % sensor
+    else:
+        # Run the recording through the parameter mapping as fast as possible
+        from input import ReplayInput
+        replay = ReplayInput(path, realtime=False, loop=False)
+        start = time.time()
+        for frame in range(len(replay.sensor)):
+            replay.time = frame
+            replay.inputs(frame)
+        seconds = time.time() - start
+        print "Mapped %d frames in %.3fs, %.0f frames/second" % (len(replay.sensor), seconds, len(replay.sensor) / max(seconds, 1e-9))
@@ -1,71 +1,190 @@
 from vispy import app, gloo, set_log_level
 import random
 import sys
-from fractal import FractalProgram
+from fractal import FractalProgram, choose_variant
+from accumulation import ProgressiveAccumulator
+from quality import QUALITY_PRESETS, DEFAULT_QUALITY, quality_defines
+from gl_mode import GL_MODES, use_gl_mode
 from input import RandomInput, FileStoredInput
 from definitions import Definitions
+from probe import PROBE_SIZE, PROBE_THRESHOLDS, score_image, failed_thresholds
 from vispy.io import write_png
 from vispy.gloo.util import _screenshot
 import yaml
 
 
+def pick_cover(inputs_path=None):
+    if inputs_path is not None:
+        input_manager = FileStoredInput(inputs_path)
+        time = input_manager.stored_time
+        definition = Definitions[input_manager.stored_definition_name]
+    else:
+        input_manager = RandomInput()
+        time = float(random.randint(0, 345212312))
+        definition = Definitions[random.choice(Definitions.keys())]
+
+    return input_manager, time, definition
+
+
+def pick_probed_cover(render_probe, thresholds=PROBE_THRESHOLDS, attempts=50):
+    """
+    Pick random covers until one scores at least `thresholds` when drawn at
+    PROBE_SIZE by `render_probe(definition, variant, inputs, time)`, so
+    nearly empty or washed out covers are never rendered in full. Returns
+    the cover and the variant it was probed with, or the last one tried if
+    none of `attempts` passed.
+    """
+    for attempt in range(attempts):
+        input_manager, time, definition = pick_cover()
+        variant = choose_variant(definition)
+        scores = score_image(render_probe(definition, variant, input_manager.inputs(time), time))
+        failed = failed_thresholds(scores, thresholds)
+        if not failed:
+            print "Probe %d of %s at %s passed: %s" % (attempt + 1, definition['name'], time, _format_scores(scores))
+            break
+        print "Probe %d of %s at %s rejected for %s: %s" % (attempt + 1, definition['name'], time, ', '.join(failed), _format_scores(scores))
+    else:
+        print "No probe passed in %d attempts, using the last one" % attempts
+    return input_manager, time, definition, variant
+
+
+def _format_scores(scores):
+    return ', '.join('%s %.3f' % (name, score) for name, score in scores.iteritems())
+
+
+def write_cover(image, inputs, time, definition_name):
+    write_png('covers2/%s.png' % time, image)
+    write_cover_data(inputs, time, definition_name)
+
+
+def write_cover_data(inputs, time, definition_name):
+    data = {}
+    data.update(inputs)
+    data['time'] = time
+    data['definition'] = definition_name
+
+    with open('covers2/%s.yml' % time, 'w') as f:
+        yaml.dump(data, stream=f)
+
+    print "Wrote image and data for %s" % time
+
+
+def render_covers(count, size, inputs_path=None, backend='osmesa', passes=1, quality=DEFAULT_QUALITY, tile_size=0, thresholds=PROBE_THRESHOLDS, attempts=50):
+    from offscreen import render_still, render_tiled
+
+    def render_probe(definition, variant, inputs, time):
+        return render_still(definition, inputs, time, PROBE_SIZE, backend=backend, quality=quality, variant=variant)
+
+    for i in range(count):
+        # Random covers are probed first unless `thresholds` is None
+        if inputs_path is None and thresholds is not None:
+            input_manager, time, definition, variant = pick_probed_cover(render_probe, thresholds, attempts)
+        else:
+            input_manager, time, definition = pick_cover(inputs_path)
+            variant = None
+
+        if tile_size:
+            # Poster sizes are streamed to the PNG a row of tiles at a time
+            render_tiled(definition, input_manager.inputs(time), time, size, 'covers2/%s.png' % time, tile_size=tile_size, backend=backend, passes=passes, quality=quality, variant=variant)
+            gloo.gl.check_error('rendering cover')
+            write_cover_data(input_manager.smoothed_inputs, time, definition['name'])
+        else:
+            image = render_still(definition, input_manager.inputs(time), time, size, backend=backend, passes=passes, quality=quality, variant=variant)
+            gloo.gl.check_error('rendering cover')
+            write_cover(image, input_manager.smoothed_inputs, time, definition['name'])
+
+
 class StillCanvas(app.Canvas):
 
     def __init__(self, *args, **kwargs):
         self.exit = kwargs.pop('exit', False)
         self.inputs_path = kwargs.pop('inputs_path', None)
+        self.progressive_passes = kwargs.pop('progressive_passes', 0)
+        self.quality = kwargs.pop('quality', DEFAULT_QUALITY)
+        thresholds = kwargs.pop('thresholds', PROBE_THRESHOLDS)
+        attempts = kwargs.pop('attempts', 50)
         super(StillCanvas, self).__init__(*args, **kwargs)
         gloo.set_state(clear_color='black', blend=True, blend_func=('src_alpha', 'one_minus_src_alpha'))
 
         self.inputs = None
+        self.dirty = True
 
-        if self.inputs_path is not None:
-            self.input_manager = FileStoredInput(self.inputs_path)
-            self.time = self.input_manager.stored_time
-            definition = Definitions[self.input_manager.stored_definition_name]
+        if self.inputs_path is None and thresholds is not None:
+            self.input_manager, self.time, self.fractal = self._probed_cover(thresholds, attempts)
         else:
-            self.input_manager = RandomInput()
-            self.time = float(random.randint(0, 345212312))
-            definition = Definitions[random.choice(Definitions.keys())]
-
-        self.fractal = FractalProgram(definition, mask=False)
+            self.input_manager, self.time, definition = pick_cover(self.inputs_path)
+            self.fractal = FractalProgram(definition, mask=False, defines=quality_defines(self.quality))
 
         self.apply_zoom()
-        self._timer = app.Timer(1.0 / 5, connect=self.update, start=True)
+        if self.progressive_passes > 0:
+            # Keep drawing as fast as possible until the accumulated passes converge
+            self.accumulator = ProgressiveAccumulator(max_passes=self.progressive_passes)
+            self._timer = app.Timer('auto', connect=self.on_timer, start=True)
+        else:
+            self.accumulator = None
+            self._timer = app.Timer(1.0 / 5, connect=self.on_timer, start=True)
         if self.exit:
-            app.Timer(1, connect=self.write_and_exit, start=True, iterations=1)
+            app.Timer(1, connect=self.write_and_exit, start=True)
         # self.update(None)
         # self.update(None)
         self.show()
         # self.write_and_exit()
 
+    def _probed_cover(self, thresholds, attempts):
+        # Candidates share a program per variant, and the chosen one keeps its program
+        from program_pool import FractalProgramPool
+        from resolution import RenderTarget
+        fractals = FractalProgramPool([], mask=False, quality=self.quality)
+        target = RenderTarget(PROBE_SIZE)
+
+        def render_probe(definition, variant, inputs, time):
+            fractal = fractals.get(definition, variant=variant)
+            fractal['time'] = time
+            fractal['resolution'] = list(PROBE_SIZE)
+            fractal.adjust(inputs)
+            with target.framebuffer:
+                gloo.set_viewport(0, 0, *PROBE_SIZE)
+                gloo.clear()
+                fractal.draw()
+                return target.framebuffer.read()
+
+        input_manager, time, definition, variant = pick_probed_cover(render_probe, thresholds, attempts)
+        target.framebuffer.delete()
+        target.texture.delete()
+        return input_manager, time, fractals.get(definition, variant=variant)
+
     def write(self):
+        # Frames stop being drawn once the cover settles, so draw it again for the screenshot
+        self.on_draw(None)
+        self.context.flush_commands()
+        gloo.gl.check_error('before writing cover')
         image = _screenshot(alpha=True)
-        write_png('covers2/%s.png' % self.time, image)
-
-        data = {}
-        data.update(self.input_manager.smoothed_inputs)
-        data['time'] = self.time
-        data['definition'] = self.fractal.definition['name']
-
-        with open('covers2/%s.yml' % self.time, 'w') as f:
-            yaml.dump(data, stream=f)
-
-        print "Wrote image and data for %s" % self.time
+        write_cover(image, self.input_manager.smoothed_inputs, self.time, self.fractal.definition['name'])
 
     def write_and_exit(self, event=None):
+        if self.accumulator is not None and not self.accumulator.converged:
+            return
         self.write()
         sys.exit(0)
 
     def on_draw(self, event):
         self.input_manager.time = self.time
         self.fractal['time'] = self.time
-        self.fractal.draw()
+        if self.accumulator is not None:
+            self.accumulator.draw(self.fractal, self.physical_size)
+        else:
+            self.fractal.draw()
         self.inputs = self.input_manager.inputs(self.time)
-        self.fractal.adjust(self.inputs)
+        self.dirty = self.fractal.adjust(self.inputs)
+
+    def on_timer(self, event):
+        # The inputs are constant, so only draw until they've been applied and any passes converge
+        if self.dirty or (self.accumulator is not None and not self.accumulator.converged):
+            self.update()
 
     def on_resize(self, event):
         self.apply_zoom()
+        self.dirty = True
 
     def apply_zoom(self):
         width, height = self.physical_size
@@ -79,6 +198,7 @@ class StillCanvas(app.Canvas):
         else:
             self.input_manager.on_key_press(event)
             print self.inputs
+            self.dirty = True
             self.update()
 
 
@@ -89,14 +209,40 @@ if __name__ == '__main__':
     parser.add_option("-H", "--height", type="int", default=600)
     parser.add_option("-e", "--exit", action="store_true")
     parser.add_option("-l", "--path", type="string")
+    parser.add_option("-o", "--offscreen", action="store_true")
+    parser.add_option("-n", "--count", type="int", default=1)
+    parser.add_option("--backend", type="string", default="osmesa")
+    parser.add_option("-p", "--progressive", type="int", default=0)
+    parser.add_option("-q", "--quality", type="choice", choices=QUALITY_PRESETS.keys(), default=DEFAULT_QUALITY)
+    parser.add_option("--gl-mode", type="choice", choices=GL_MODES, default="debug")
+    parser.add_option("-t", "--tile", type="int", default=0)
+    parser.add_option("--no-probe", action="store_true")
+    parser.add_option("--attempts", type="int", default=50)
+    parser.add_option("--min-coverage", type="float", default=PROBE_THRESHOLDS['coverage'])
+    parser.add_option("--min-color-variance", type="float", default=PROBE_THRESHOLDS['color_variance'])
+    parser.add_option("--min-edge-density", type="float", default=PROBE_THRESHOLDS['edge_density'])
 
     (options, args) = parser.parse_args()
     set_log_level('INFO')
-    gloo.gl.use_gl('gl2 debug')
+    use_gl_mode(options.gl_mode)
+    thresholds = None if options.no_probe else {
+        'coverage': options.min_coverage,
+        'color_variance': options.min_color_variance,
+        'edge_density': options.min_edge_density,
+    }
+
+    if options.offscreen or options.tile:
+        render_covers(options.count, (options.width, options.height), inputs_path=options.path, backend=options.backend, passes=max(options.progressive, 1), quality=options.quality,
+                      tile_size=options.tile, thresholds=thresholds, attempts=options.attempts)
+        sys.exit(0)
 
     canvas = StillCanvas(size=(options.width, options.height),
                          keys='interactive',
                          resizable=True,
                          inputs_path=options.path,
-                         exit=options.exit)
+                         exit=options.exit,
+                         progressive_passes=options.progressive,
+                         quality=options.quality,
+                         thresholds=thresholds,
+                         attempts=options.attempts)
     app.run()
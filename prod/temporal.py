@@ -0,0 +1,67 @@
+from vispy import gloo
+from blit import BlitProgram
+from resolution import RenderTarget
+
+# Matches the RotateY(pos, time*0.025) spin in fractal.frag
+ROTATION_SPEED = 0.025
+
+
+class TemporalReprojector(object):
+    """
+    Draws a `FractalProgram` compiled with TEMPORAL_REPROJECTION so that each
+    pixel's rays start just short of where they hit last frame. Frames
+    ping-pong between two float targets whose alpha holds the hit depth, and
+    the current one is blitted to the bound framebuffer.
+
+    The start margin grows with how far the scene spun since the last frame.
+    A resize, a different program or an input jump bigger than
+    `jump_threshold` falls back to a full march for one frame.
+    """
+
+    def __init__(self, margin=0.05, scene_radius=10.0, jump_threshold=0.05):
+        self.margin = margin
+        self.scene_radius = scene_radius
+        self.jump_threshold = jump_threshold
+
+        self.targets = [RenderTarget(internalformat='rgba32f', interpolation='nearest'),
+                        RenderTarget(internalformat='rgba32f', interpolation='nearest')]
+        self.blit = BlitProgram(self.targets[0].texture)
+
+        self.valid = False
+        self._fractal = None
+        self._inputs = {}
+        self._time = None
+
+    def invalidate(self):
+        self.valid = False
+
+    def _jumped(self, inputs):
+        return any(abs(value - self._inputs.get(key, value)) > self.jump_threshold for key, value in inputs.iteritems())
+
+    def draw(self, fractal, size, inputs, time):
+        previous, current = self.targets
+        previous.resize(size)
+        if current.resize(size) or fractal is not self._fractal or self._jumped(inputs or {}):
+            self.invalidate()
+
+        rotation = abs(time - self._time) * ROTATION_SPEED if self._time is not None else 0
+        fractal['previousDepth'] = previous.texture
+        fractal['temporalValid'] = self.valid
+        fractal['temporalMargin'] = self.margin + rotation * self.scene_radius
+
+        # Blending would scale the stored colour by the depth kept in alpha
+        with current.framebuffer:
+            gloo.set_viewport(0, 0, *size)
+            gloo.set_state(blend=False)
+            fractal.draw()
+            gloo.set_state(blend=True)
+
+        gloo.set_viewport(0, 0, *size)
+        self.blit.set_source(current.texture)
+        self.blit.draw()
+
+        self.targets.reverse()
+        self.valid = True
+        self._fractal = fractal
+        self._inputs = dict(inputs or {})
+        self._time = time
@@ -6,12 +6,6 @@ class LowConfidenceException(Exception):
     pass
 
 
-def joint_to_array(joint):
-    if joint.positionConfidence < 0.2:
-        raise LowConfidenceException
-    return np.asarray((joint.position.x, joint.position.y, joint.position.z))
-
-
 def normalize(v):
     norm = np.linalg.norm(v)
     if norm == 0:
@@ -19,6 +13,21 @@ def normalize(v):
     return v / norm
 
 
+def shader_path(name):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), name)
+
+
 def read_shader(name):
-    with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), name)) as f:
+    with open(shader_path(name)) as f:
         return f.read()
+
+
+def halton(index, base):
+    """ Element `index` of the Halton low discrepancy sequence in `base`, in [0, 1). """
+    result = 0.0
+    fraction = 1.0 / base
+    while index > 0:
+        result += fraction * (index % base)
+        index //= base
+        fraction /= base
+    return result
@@ -0,0 +1,30 @@
+import os
+
+
+class FileWatcher(object):
+    """
+    Polls files' modification times. `changed` returns the paths modified
+    since the last call, which is cheap enough to call from an app timer.
+    Files that are missing, like while an editor replaces them, are only
+    reported once they're back.
+    """
+
+    def __init__(self, paths):
+        self.mtimes = dict((path, self._mtime(path)) for path in paths)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def changed(self):
+        changed = []
+        for path, mtime in self.mtimes.items():
+            current = self._mtime(path)
+            if current is not None and current != mtime:
+                changed.append(path)
+            if current is not None:
+                self.mtimes[path] = current
+        return changed